@@ -0,0 +1,898 @@
+import time
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+# seconds each state transition takes, scaled down so a benchmark finishes
+# in seconds while keeping the relative cost of each stage
+DEFAULT_LATENCIES = {
+    'create_snapshot': 2.0,
+    'copy_snapshot': 3.0,
+    'delete_snapshot': 0.2,
+    'restore_instance': 3.0,
+    'restore_point_in_time': 3.0,
+    'modify_instance': 0.5,
+    'reboot_instance': 0.5,
+    'rename_instance': 0.3,
+    'delete_instance': 1.0,
+    'ssm_command': 0.5,
+    'warm_script': 2.0,
+    'storage_optimization': 30.0,
+    'create_cluster_snapshot': 2.0,
+    'copy_cluster_snapshot': 3.0,
+    'restore_cluster': 3.0,
+    'clone_cluster': 1.0,
+    'create_cluster_instance': 1.0,
+    'modify_cluster': 0.5,
+    'delete_cluster': 1.0,
+    'share_resource': 0.2,
+    'api_call': 0.002
+}
+
+
+class ClientError(Exception):
+
+    def __init__(self, code, message=''):
+        super().__init__(f'{code}: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class Exceptions:
+    # mirrors the client.exceptions.<Name> lookups the code under test makes
+
+    def __getattr__(self, name):
+        exception = type(name, (ClientError,), {})
+        setattr(self, name, exception)
+        return exception
+
+
+class Events:
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, event, handler, *args, **kwargs):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, **kwargs):
+        for handler in self.handlers.get(event, []):
+            handler(**kwargs)
+
+
+class Meta:
+
+    def __init__(self):
+        self.events = Events()
+
+
+class Operation:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Paginator:
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+
+class Resource:
+    # a resource whose status moves through timed transitions, read lazily
+
+    def __init__(self, attributes, status, transitions=()):
+        self.attributes = attributes
+        self.status = status
+        self.transitions = []
+        self.add_transitions(transitions)
+
+    def add_transitions(self, transitions):
+        now = time.monotonic()
+        for delay, status in transitions:
+            now += delay
+            self.transitions.append((now, status))
+
+    def current(self):
+        now = time.monotonic()
+        while self.transitions and self.transitions[0][0] <= now:
+            self.status = self.transitions.pop(0)[1]
+        return self.status
+
+    def progress(self):
+        if not self.transitions:
+            return 100
+        start = self.attributes.get('_started', time.monotonic())
+        end = self.transitions[-1][0]
+        return int(100 * (time.monotonic() - start) / max(end - start, 1e-6))
+
+
+class FakeAWS:
+
+    def __init__(self, latencies=None, throttle_rate=0.0, seed=0):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.instances = {}
+        self.snapshots = {}
+        self.clusters = {}
+        self.cluster_snapshots = {}
+        self.shares = {}
+        self.replicated_backups = {}
+        self.keys = {}
+        self.parameters = {}
+        self.commands = {}
+        self.fleets = {}
+        self.calls = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def add_instance(self, account, region, identifier, **attributes):
+        self.instances[(account, region, identifier)] = Resource(dict({
+            'DBInstanceIdentifier': identifier,
+            'AllocatedStorage': 100,
+            'Engine': 'postgres',
+            'DBInstanceClass': 'db.t3.small',
+            'StorageType': 'gp2',
+            'BackupRetentionPeriod': 7,
+            'InstanceCreateTime': datetime.now(tz=timezone.utc),
+            'DBParameterGroups': [],
+            'PendingModifiedValues': {}
+        }, **attributes), 'available')
+
+    def replicate_backups(self, account, region, identifier, dest_region):
+        # the instance's automated backups are replicated to dest_region
+        arn = f'arn:aws:rds:{dest_region}:{account}:auto-backup:' \
+              f'ab-{identifier}'
+        self.replicated_backups[arn] = (account, dest_region,
+                                        (account, region, identifier))
+        instance = self.instances[(account, region, identifier)]
+        instance.attributes.setdefault(
+            'DBInstanceAutomatedBackupsReplications', []).append(
+            {'DBInstanceAutomatedBackupsArn': arn})
+
+    def add_cluster(self, account, region, identifier, **attributes):
+        self.clusters[(account, region, identifier)] = Resource(dict({
+            'DBClusterIdentifier': identifier,
+            'DBClusterArn': f'arn:aws:rds:{region}:{account}:cluster:'
+                            f'{identifier}',
+            'AllocatedStorage': 100,
+            'Engine': 'aurora-postgresql',
+            'EngineVersion': '15.4',
+            'ClusterCreateTime': datetime.now(tz=timezone.utc)
+        }, **attributes), 'available')
+
+    def add_key(self, account, region, key_id, aliases=()):
+        arn = f'arn:aws:kms:{region}:{account}:key/{key_id}'
+        key = {'KeyId': key_id, 'Arn': arn, 'Policy': {'Statement': []}}
+        for name in (key_id, arn) + tuple(aliases):
+            self.keys[(account, region, name)] = key
+
+    def add_parameter(self, account, region, name, value):
+        self.parameters[(account, region, name)] = value
+
+    def shared_with(self, resource_arn, account):
+        for share in self.shares.values():
+            if share['status'] == 'ACTIVE' and \
+                    resource_arn in share['resources'] and \
+                    share['principals'].get(account) == 'ASSOCIATED' and \
+                    time.monotonic() >= share['associated']:
+                return True
+        return False
+
+    def add_fleet(self, account, region, name, count):
+        # instances with Name tag name that SSM commands can target
+        self.fleets[(account, region, name)] = count
+
+    def session(self, **kwargs):
+        return FakeSession(self, **kwargs)
+
+    def latency(self, name):
+        return self.latencies[name]
+
+    def record_call(self, service, operation):
+        with self.lock:
+            key = f'{service}.{operation}'
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finish_call(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def calls_per_service(self):
+        services = {}
+        for key, count in self.calls.items():
+            service = key.split('.')[0]
+            services[service] = services.get(service, 0) + count
+        return services
+
+    def throttled(self):
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+
+class FakeSession:
+
+    def __init__(self, aws, aws_session_token=None, **kwargs):
+        self.aws = aws
+        # the fake STS hands out the role ARN as the session token, so a
+        # session knows which account it is acting in
+        self.account = None
+        if aws_session_token is not None:
+            self.account = aws_session_token.split(':')[4]
+
+    def client(self, service_name, region_name='ap-southeast-2', **kwargs):
+        client = {
+            'sts': FakeSTS,
+            'rds': FakeRDS,
+            'kms': FakeKMS,
+            'ssm': FakeSSM,
+            'autoscaling': FakeAutoScaling,
+            'ram': FakeRAM
+        }[service_name](self.aws, region_name)
+        client.account = self.account
+        return client
+
+
+class FakeClient:
+    service = None
+    max_attempts = 10
+
+    def __init__(self, aws, region):
+        self.aws = aws
+        self.region = region
+        self.account = None
+        self.meta = Meta()
+        self.exceptions = Exceptions()
+
+    def get_paginator(self, name):
+        return Paginator(getattr(self, name))
+
+    def call(self, operation, fn):
+        # behaves like a botocore call: events per attempt, retries on
+        # throttling, one after-call per operation
+        self.aws.record_call(self.service, operation)
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                self.meta.events.emit('before-send')
+                time.sleep(self.aws.latency('api_call'))
+                if attempt < self.max_attempts and self.aws.throttled():
+                    self.meta.events.emit(
+                        'needs-retry',
+                        response=(None, {'Error': {'Code': 'Throttling'}}),
+                        operation=Operation(operation))
+                    time.sleep(self.aws.latency('api_call') * 2 ** attempt)
+                    continue
+                # after-call fires for error responses too
+                try:
+                    with self.aws.lock:
+                        return fn()
+                finally:
+                    self.meta.events.emit('after-call')
+        finally:
+            self.aws.finish_call()
+
+    def __getattr__(self, name):
+        # only reached for names the client doesn't define, i.e. operations
+        operation = getattr(type(self), f'op_{name}', None)
+        if operation is None:
+            raise AttributeError(name)
+        return lambda **kwargs: self.call(
+            name, lambda: operation(self, **kwargs))
+
+
+class FakeSTS(FakeClient):
+    service = 'sts'
+
+    def op_assume_role(self, RoleArn, RoleSessionName, DurationSeconds):
+        return {'Credentials': {
+            'AccessKeyId': 'AKIAFAKE',
+            'SecretAccessKey': 'fake',
+            'SessionToken': RoleArn,
+            'Expiration': datetime.now(tz=timezone.utc) +
+            timedelta(seconds=DurationSeconds)
+        }}
+
+
+class FakeRDS(FakeClient):
+    service = 'rds'
+
+    def key(self, identifier):
+        return (self.account, self.region, identifier)
+
+    def instance(self, identifier):
+        instance = self.aws.instances.get(self.key(identifier))
+        if instance is None or instance.current() == 'deleted':
+            raise self.exceptions.DBInstanceNotFoundFault(identifier)
+        return instance
+
+    def snapshot(self, identifier):
+        if identifier.startswith('arn:'):
+            parts = identifier.split(':')
+            key = (parts[4], parts[3], ':'.join(parts[6:]))
+        else:
+            key = self.key(identifier)
+        snapshot = self.aws.snapshots.get(key)
+        if snapshot is None or snapshot.current() == 'deleted':
+            raise self.exceptions.DBSnapshotNotFoundFault(identifier)
+        return snapshot
+
+    def describe_instance(self, instance):
+        return dict(instance.attributes, DBInstanceStatus=instance.current())
+
+    def describe_snapshot(self, snapshot):
+        return dict(snapshot.attributes, Status=snapshot.current(),
+                    PercentProgress=snapshot.progress())
+
+    def filter_values(self, Filters, name):
+        for f in Filters or []:
+            if f['Name'] == name:
+                return set(f['Values'])
+        return None
+
+    def op_describe_db_instances(self, DBInstanceIdentifier=None,
+                                 Filters=None):
+        if DBInstanceIdentifier is not None:
+            return {'DBInstances': [
+                self.describe_instance(self.instance(DBInstanceIdentifier))]}
+        ids = self.filter_values(Filters, 'db-instance-id')
+        return {'DBInstances': [
+            self.describe_instance(i)
+            for (a, r, name), i in list(self.aws.instances.items())
+            if (a, r) == (self.account, self.region) and
+            (ids is None or name in ids) and i.current() != 'deleted']}
+
+    def op_describe_db_snapshots(self, DBSnapshotIdentifier=None,
+                                 Filters=None, DBInstanceIdentifier=None,
+                                 SnapshotType=None):
+        if DBSnapshotIdentifier is not None:
+            return {'DBSnapshots': [
+                self.describe_snapshot(self.snapshot(DBSnapshotIdentifier))]}
+        ids = self.filter_values(Filters, 'db-snapshot-id')
+        snapshots = []
+        for (a, r, name), s in list(self.aws.snapshots.items()):
+            if (a, r) != (self.account, self.region) or \
+                    s.current() == 'deleted':
+                continue
+            if ids is not None and name not in ids:
+                continue
+            if DBInstanceIdentifier is not None and \
+                    s.attributes['DBInstanceIdentifier'] != \
+                    DBInstanceIdentifier:
+                continue
+            if SnapshotType is not None and \
+                    s.attributes['SnapshotType'] != SnapshotType:
+                continue
+            snapshots.append(self.describe_snapshot(s))
+        return {'DBSnapshots': snapshots}
+
+    def new_snapshot(self, identifier, source, latency, Tags=None):
+        snapshot = Resource({
+            'DBSnapshotIdentifier': identifier,
+            'DBInstanceIdentifier': source['DBInstanceIdentifier'],
+            'SnapshotType': 'manual',
+            'SnapshotCreateTime': datetime.now(tz=timezone.utc),
+            'AllocatedStorage': source['AllocatedStorage'],
+            'Engine': source['Engine'],
+            'TagList': Tags or [],
+            '_started': time.monotonic()
+        }, 'creating', [(latency, 'available')])
+        self.aws.snapshots[self.key(identifier)] = snapshot
+        return {'DBSnapshot': self.describe_snapshot(snapshot)}
+
+    def op_create_db_snapshot(self, DBSnapshotIdentifier,
+                              DBInstanceIdentifier, Tags=None):
+        instance = self.instance(DBInstanceIdentifier)
+        return self.new_snapshot(DBSnapshotIdentifier, instance.attributes,
+                                 self.aws.latency('create_snapshot'), Tags)
+
+    def op_copy_db_snapshot(self, SourceDBSnapshotIdentifier,
+                            TargetDBSnapshotIdentifier, KmsKeyId=None,
+                            SourceRegion=None, Tags=None):
+        source = self.snapshot(SourceDBSnapshotIdentifier)
+        if source.current() != 'available':
+            raise self.exceptions.InvalidDBSnapshotStateFault(
+                SourceDBSnapshotIdentifier)
+        return self.new_snapshot(TargetDBSnapshotIdentifier,
+                                 source.attributes,
+                                 self.aws.latency('copy_snapshot'), Tags)
+
+    def op_delete_db_snapshot(self, DBSnapshotIdentifier):
+        snapshot = self.snapshot(DBSnapshotIdentifier)
+        snapshot.status = 'deleting'
+        snapshot.transitions = []
+        snapshot.add_transitions(
+            [(self.aws.latency('delete_snapshot'), 'deleted')])
+        return {}
+
+    def op_modify_db_snapshot_attribute(self, DBSnapshotIdentifier,
+                                        AttributeName, ValuesToAdd):
+        self.snapshot(DBSnapshotIdentifier)
+        return {}
+
+    def new_instance(self, identifier, source, latency, kwargs):
+        if self.key(identifier) in self.aws.instances and \
+                self.aws.instances[self.key(identifier)] \
+                .current() != 'deleted':
+            raise self.exceptions.DBInstanceAlreadyExistsFault(identifier)
+        instance = Resource({
+            'DBInstanceIdentifier': identifier,
+            'DBInstanceArn': f'arn:aws:rds:{self.region}:{self.account}:db:'
+                             f'{identifier}',
+            'Endpoint': {'Address': f'{identifier}.{self.region}.rds',
+                         'Port': 5432},
+            'MasterUsername': 'postgres',
+            'AllocatedStorage': source['AllocatedStorage'],
+            'Engine': source['Engine'],
+            'DBInstanceClass': kwargs.get('DBInstanceClass'),
+            'StorageType': kwargs.get('StorageType'),
+            'InstanceCreateTime': datetime.now(tz=timezone.utc),
+            'DBParameterGroups': [{
+                'DBParameterGroupName': kwargs.get('DBParameterGroupName',
+                                                   'default'),
+                'ParameterApplyStatus': 'in-sync'}],
+            'PendingModifiedValues': {}
+        }, 'creating', [(latency, 'available')])
+        self.aws.instances[self.key(identifier)] = instance
+        return {'DBInstance': self.describe_instance(instance)}
+
+    def op_restore_db_instance_from_db_snapshot(self, DBInstanceIdentifier,
+                                                DBSnapshotIdentifier,
+                                                **kwargs):
+        snapshot = self.snapshot(DBSnapshotIdentifier)
+        return self.new_instance(DBInstanceIdentifier, snapshot.attributes,
+                                 self.aws.latency('restore_instance'), kwargs)
+
+    def op_restore_db_instance_to_point_in_time(
+            self, TargetDBInstanceIdentifier, SourceDBInstanceIdentifier=None,
+            SourceDBInstanceAutomatedBackupsArn=None, RestoreTime=None,
+            UseLatestRestorableTime=False, **kwargs):
+        if SourceDBInstanceAutomatedBackupsArn is not None:
+            backups = self.aws.replicated_backups.get(
+                SourceDBInstanceAutomatedBackupsArn)
+            if backups is None or backups[:2] != (self.account, self.region):
+                raise self.exceptions.DBInstanceAutomatedBackupNotFoundFault(
+                    SourceDBInstanceAutomatedBackupsArn)
+            source = self.aws.instances[backups[2]]
+        else:
+            source = self.instance(SourceDBInstanceIdentifier)
+        if not source.attributes.get('BackupRetentionPeriod'):
+            raise self.exceptions.InvalidDBInstanceStateFault(
+                'Automated backups are not enabled')
+        if (RestoreTime is None) == (not UseLatestRestorableTime):
+            raise self.exceptions.InvalidParameterCombination(
+                'Give one of RestoreTime and UseLatestRestorableTime')
+        return self.new_instance(TargetDBInstanceIdentifier,
+                                 source.attributes,
+                                 self.aws.latency('restore_point_in_time'),
+                                 kwargs)
+
+    def op_add_tags_to_resource(self, ResourceName, Tags):
+        instance = self.instance(ResourceName.split(':')[-1])
+        tags = {t['Key']: t['Value']
+                for t in instance.attributes.get('TagList', []) + Tags}
+        instance.attributes['TagList'] = [
+            {'Key': k, 'Value': v} for k, v in tags.items()]
+        return {}
+
+    def op_modify_db_instance(self, DBInstanceIdentifier, **kwargs):
+        instance = self.instance(DBInstanceIdentifier)
+        if 'NewDBInstanceIdentifier' in kwargs:
+            new = kwargs['NewDBInstanceIdentifier']
+            del self.aws.instances[self.key(DBInstanceIdentifier)]
+            instance.attributes['DBInstanceIdentifier'] = new
+            self.aws.instances[self.key(new)] = instance
+            # a rename interrupts any storage optimisation, which then
+            # carries on
+            status = instance.current()
+            instance.status = 'renaming'
+            instance.transitions.insert(0, (
+                time.monotonic() + self.aws.latency('rename_instance'),
+                status))
+        else:
+            if 'DBParameterGroupName' in kwargs:
+                instance.attributes['DBParameterGroups'] = [{
+                    'DBParameterGroupName': kwargs['DBParameterGroupName'],
+                    'ParameterApplyStatus': 'pending-reboot'}]
+            if 'DBInstanceClass' in kwargs:
+                instance.attributes['DBInstanceClass'] = \
+                    kwargs['DBInstanceClass']
+            transitions = [(self.aws.latency('modify_instance'), 'available')]
+            if 'StorageType' in kwargs:
+                instance.attributes['StorageType'] = kwargs['StorageType']
+                # storage changes keep optimising long after they apply
+                transitions = [
+                    (self.aws.latency('modify_instance'),
+                     'storage-optimization'),
+                    (self.aws.latency('storage_optimization'), 'available')]
+            instance.status = 'modifying'
+            instance.add_transitions(transitions)
+        return {'DBInstance': self.describe_instance(instance)}
+
+    def op_reboot_db_instance(self, DBInstanceIdentifier):
+        instance = self.instance(DBInstanceIdentifier)
+        for group in instance.attributes['DBParameterGroups']:
+            group['ParameterApplyStatus'] = 'in-sync'
+        instance.status = 'rebooting'
+        instance.add_transitions(
+            [(self.aws.latency('reboot_instance'), 'available')])
+        return {'DBInstance': self.describe_instance(instance)}
+
+    def op_delete_db_instance(self, DBInstanceIdentifier, **kwargs):
+        instance = self.instance(DBInstanceIdentifier)
+        instance.status = 'deleting'
+        instance.transitions = []
+        instance.add_transitions(
+            [(self.aws.latency('delete_instance'), 'deleted')])
+        return {'DBInstance': self.describe_instance(instance)}
+
+    def cluster(self, identifier):
+        cluster = self.aws.clusters.get(self.key(identifier))
+        if cluster is None or cluster.current() == 'deleted':
+            raise self.exceptions.DBClusterNotFoundFault(identifier)
+        return cluster
+
+    def cluster_snapshot(self, identifier):
+        if identifier.startswith('arn:'):
+            parts = identifier.split(':')
+            key = (parts[4], parts[3], ':'.join(parts[6:]))
+        else:
+            key = self.key(identifier)
+        snapshot = self.aws.cluster_snapshots.get(key)
+        if snapshot is None or snapshot.current() == 'deleted':
+            raise self.exceptions.DBClusterSnapshotNotFoundFault(identifier)
+        return snapshot
+
+    def describe_cluster(self, cluster):
+        identifier = cluster.attributes['DBClusterIdentifier']
+        members = [
+            {'DBInstanceIdentifier': name, 'IsClusterWriter': True}
+            for (a, r, name), i in list(self.aws.instances.items())
+            if (a, r) == (self.account, self.region) and
+            i.attributes.get('DBClusterIdentifier') == identifier and
+            i.current() != 'deleted']
+        return dict(cluster.attributes, Status=cluster.current(),
+                    DBClusterMembers=members)
+
+    def describe_cluster_snapshot(self, snapshot):
+        return dict(snapshot.attributes, Status=snapshot.current(),
+                    PercentProgress=snapshot.progress())
+
+    def op_describe_db_clusters(self, DBClusterIdentifier=None,
+                                Filters=None):
+        if DBClusterIdentifier is not None:
+            return {'DBClusters': [
+                self.describe_cluster(self.cluster(DBClusterIdentifier))]}
+        ids = self.filter_values(Filters, 'db-cluster-id')
+        return {'DBClusters': [
+            self.describe_cluster(c)
+            for (a, r, name), c in list(self.aws.clusters.items())
+            if (a, r) == (self.account, self.region) and
+            (ids is None or name in ids) and c.current() != 'deleted']}
+
+    def op_describe_db_cluster_snapshots(self,
+                                         DBClusterSnapshotIdentifier=None,
+                                         Filters=None):
+        if DBClusterSnapshotIdentifier is not None:
+            return {'DBClusterSnapshots': [self.describe_cluster_snapshot(
+                self.cluster_snapshot(DBClusterSnapshotIdentifier))]}
+        ids = self.filter_values(Filters, 'db-cluster-snapshot-id')
+        return {'DBClusterSnapshots': [
+            self.describe_cluster_snapshot(c)
+            for (a, r, name), c in list(self.aws.cluster_snapshots.items())
+            if (a, r) == (self.account, self.region) and
+            (ids is None or name in ids) and c.current() != 'deleted']}
+
+    def new_cluster_snapshot(self, identifier, source, latency):
+        snapshot = Resource({
+            'DBClusterSnapshotIdentifier': identifier,
+            'DBClusterIdentifier': source['DBClusterIdentifier'],
+            'Engine': source['Engine'],
+            'EngineVersion': source['EngineVersion'],
+            'AllocatedStorage': source['AllocatedStorage'],
+            '_started': time.monotonic()
+        }, 'creating', [(latency, 'available')])
+        self.aws.cluster_snapshots[self.key(identifier)] = snapshot
+        return {'DBClusterSnapshot': self.describe_cluster_snapshot(snapshot)}
+
+    def op_create_db_cluster_snapshot(self, DBClusterSnapshotIdentifier,
+                                      DBClusterIdentifier, Tags=None):
+        cluster = self.cluster(DBClusterIdentifier)
+        return self.new_cluster_snapshot(
+            DBClusterSnapshotIdentifier, cluster.attributes,
+            self.aws.latency('create_cluster_snapshot'))
+
+    def op_copy_db_cluster_snapshot(self, SourceDBClusterSnapshotIdentifier,
+                                    TargetDBClusterSnapshotIdentifier,
+                                    KmsKeyId=None, SourceRegion=None,
+                                    Tags=None):
+        source = self.cluster_snapshot(SourceDBClusterSnapshotIdentifier)
+        return self.new_cluster_snapshot(
+            TargetDBClusterSnapshotIdentifier, source.attributes,
+            self.aws.latency('copy_cluster_snapshot'))
+
+    def op_delete_db_cluster_snapshot(self, DBClusterSnapshotIdentifier):
+        snapshot = self.cluster_snapshot(DBClusterSnapshotIdentifier)
+        snapshot.status = 'deleted'
+        snapshot.transitions = []
+        return {}
+
+    def op_modify_db_cluster_snapshot_attribute(self,
+                                                DBClusterSnapshotIdentifier,
+                                                AttributeName, ValuesToAdd):
+        self.cluster_snapshot(DBClusterSnapshotIdentifier)
+        return {}
+
+    def new_cluster(self, identifier, source, latency):
+        if self.key(identifier) in self.aws.clusters and \
+                self.aws.clusters[self.key(identifier)].current() != \
+                'deleted':
+            raise self.exceptions.DBClusterAlreadyExistsFault(identifier)
+        cluster = Resource({
+            'DBClusterIdentifier': identifier,
+            'DBClusterArn': f'arn:aws:rds:{self.region}:{self.account}:'
+                            f'cluster:{identifier}',
+            'AllocatedStorage': source['AllocatedStorage'],
+            'Engine': source['Engine'],
+            'EngineVersion': source['EngineVersion'],
+            'ClusterCreateTime': datetime.now(tz=timezone.utc)
+        }, 'creating', [(latency, 'available')])
+        self.aws.clusters[self.key(identifier)] = cluster
+        return {'DBCluster': self.describe_cluster(cluster)}
+
+    def op_restore_db_cluster_from_snapshot(self, DBClusterIdentifier,
+                                            SnapshotIdentifier, Engine,
+                                            **kwargs):
+        snapshot = self.cluster_snapshot(SnapshotIdentifier)
+        return self.new_cluster(DBClusterIdentifier, snapshot.attributes,
+                                self.aws.latency('restore_cluster'))
+
+    def op_restore_db_cluster_to_point_in_time(self, DBClusterIdentifier,
+                                               SourceDBClusterIdentifier,
+                                               RestoreType='full-copy',
+                                               **kwargs):
+        parts = SourceDBClusterIdentifier.split(':')
+        owner, region, name = parts[4], parts[3], parts[6]
+        if region != self.region:
+            raise self.exceptions.InvalidParameterValue(
+                'Clones must be in the same region')
+        if owner != self.account and not self.aws.shared_with(
+                SourceDBClusterIdentifier, self.account):
+            raise self.exceptions.DBClusterNotFoundFault(
+                SourceDBClusterIdentifier)
+        source = self.aws.clusters[(owner, region, name)]
+        latency = self.aws.latency('restore_cluster')
+        if RestoreType == 'copy-on-write':
+            latency = self.aws.latency('clone_cluster')
+        return self.new_cluster(DBClusterIdentifier, source.attributes,
+                                latency)
+
+    def op_create_db_instance(self, DBInstanceIdentifier,
+                              DBClusterIdentifier, Engine, DBInstanceClass,
+                              **kwargs):
+        cluster = self.cluster(DBClusterIdentifier)
+        instance = Resource({
+            'DBInstanceIdentifier': DBInstanceIdentifier,
+            'DBClusterIdentifier': DBClusterIdentifier,
+            'AllocatedStorage': cluster.attributes['AllocatedStorage'],
+            'Engine': Engine,
+            'DBInstanceClass': DBInstanceClass,
+            'InstanceCreateTime': datetime.now(tz=timezone.utc),
+            'DBParameterGroups': [{
+                'DBParameterGroupName': kwargs.get('DBParameterGroupName',
+                                                   'default'),
+                'ParameterApplyStatus': 'in-sync'}],
+            'PendingModifiedValues': {}
+        }, 'creating',
+            [(self.aws.latency('create_cluster_instance'), 'available')])
+        self.aws.instances[self.key(DBInstanceIdentifier)] = instance
+        return {'DBInstance': self.describe_instance(instance)}
+
+    def op_modify_db_cluster(self, DBClusterIdentifier, **kwargs):
+        cluster = self.cluster(DBClusterIdentifier)
+        cluster.status = 'modifying'
+        cluster.add_transitions(
+            [(self.aws.latency('modify_cluster'), 'available')])
+        return {'DBCluster': self.describe_cluster(cluster)}
+
+    def op_delete_db_cluster(self, DBClusterIdentifier, **kwargs):
+        cluster = self.cluster(DBClusterIdentifier)
+        if len(self.describe_cluster(cluster)['DBClusterMembers']):
+            raise self.exceptions.InvalidDBClusterStateFault(
+                DBClusterIdentifier)
+        cluster.status = 'deleting'
+        cluster.transitions = []
+        cluster.add_transitions(
+            [(self.aws.latency('delete_cluster'), 'deleted')])
+        return {'DBCluster': self.describe_cluster(cluster)}
+
+
+class FakeKMS(FakeClient):
+    service = 'kms'
+
+    def key(self, key_id):
+        key = self.aws.keys.get((self.account, self.region, key_id))
+        if key is None:
+            raise self.exceptions.NotFoundException(key_id)
+        return key
+
+    def op_describe_key(self, KeyId):
+        key = self.key(KeyId)
+        return {'KeyMetadata': {'KeyId': key['KeyId'], 'Arn': key['Arn']}}
+
+    def op_get_key_policy(self, KeyId, PolicyName):
+        return {'Policy': json.dumps(self.key(KeyId)['Policy'])}
+
+    def op_put_key_policy(self, KeyId, PolicyName, Policy):
+        self.key(KeyId)['Policy'] = json.loads(Policy)
+        return {}
+
+
+class FakeSSM(FakeClient):
+    service = 'ssm'
+    page_size = 50
+
+    def op_get_parameters(self, Names, WithDecryption=False):
+        found = []
+        invalid = []
+        for name in Names:
+            value = self.aws.parameters.get((self.account, self.region, name))
+            if value is None:
+                invalid.append(name)
+            else:
+                found.append({'Name': name, 'Value': value})
+        return {'Parameters': found, 'InvalidParameters': invalid}
+
+    def op_send_command(self, DocumentName, Targets, MaxConcurrency=None,
+                        MaxErrors=None, Parameters=None):
+        # instances run in waves of MaxConcurrency, like SSM rate control
+        count = self.aws.fleets.get(
+            (self.account, self.region, Targets[0]['Values'][0]), 0)
+        concurrency = count or 1
+        if MaxConcurrency is not None:
+            if MaxConcurrency.endswith('%'):
+                concurrency = -(-count * int(MaxConcurrency[:-1]) // 100)
+            else:
+                concurrency = int(MaxConcurrency)
+        latency = self.aws.latency('ssm_command')
+        output = ''
+        if DocumentName == 'AWS-RunShellScript':
+            # shell scripts are only sent to warm restored DBs
+            latency = self.aws.latency('warm_script')
+            output = f'warmed {100 * 1024 ** 3} bytes in ' \
+                     f'{max(int(latency), 1)}s\n'
+        command_id = f'cmd-{len(self.aws.commands)}'
+        self.aws.commands[command_id] = {
+            f'i-{command_id}-{n:05}': Resource(
+                {'StandardOutputContent': output}, 'Pending',
+                [(n // max(concurrency, 1) * latency, 'InProgress'),
+                 (latency, 'Success')])
+            for n in range(count)
+        }
+        return {'Command': {'CommandId': command_id}}
+
+    def op_list_commands(self, CommandId):
+        statuses = [invocation.current()
+                    for invocation in self.aws.commands[CommandId].values()]
+        status = 'InProgress'
+        if all(s == 'Success' for s in statuses):
+            status = 'Success'
+        return {'Commands': [{
+            'CommandId': CommandId,
+            'Status': status,
+            'TargetCount': len(statuses),
+            'CompletedCount': statuses.count('Success')
+        }]}
+
+    def op_list_command_invocations(self, CommandId, NextToken=None):
+        instances = sorted(self.aws.commands[CommandId])
+        start = int(NextToken or 0)
+        page = {'CommandInvocations': [
+            {'InstanceId': instance,
+             'Status': self.aws.commands[CommandId][instance].current()}
+            for instance in instances[start:start + self.page_size]]}
+        if start + self.page_size < len(instances):
+            page['NextToken'] = str(start + self.page_size)
+        return page
+
+    def op_get_command_invocation(self, CommandId, InstanceId):
+        invocation = self.aws.commands[CommandId][InstanceId]
+        return dict(invocation.attributes, Status=invocation.current())
+
+
+class FakeAutoScaling(FakeClient):
+    service = 'autoscaling'
+
+    def op_suspend_processes(self, AutoScalingGroupName, **kwargs):
+        return {}
+
+    def op_resume_processes(self, AutoScalingGroupName, **kwargs):
+        return {}
+
+
+class FakeRAM(FakeClient):
+    service = 'ram'
+
+    def op_get_resource_shares(self, resourceOwner, name=None,
+                               resourceShareStatus=None):
+        return {'resourceShares': [
+            {'resourceShareArn': arn, 'name': share['name'],
+             'status': share['status']}
+            for arn, share in self.aws.shares.items()
+            if share['owner'] == (self.account, self.region) and
+            (name is None or share['name'] == name) and
+            (resourceShareStatus is None or
+             share['status'] == resourceShareStatus)]}
+
+    def associate(self, share, resourceArns, principals):
+        share['resources'].update(resourceArns)
+        for principal in principals:
+            share['principals'].setdefault(principal, 'PENDING')
+        share['associated'] = time.monotonic() + \
+            self.aws.latency('share_resource')
+
+    def op_create_resource_share(self, name, resourceArns, principals,
+                                 allowExternalPrincipals=True):
+        arn = f'arn:aws:ram:{self.region}:{self.account}:resource-share/' \
+              f'{len(self.aws.shares)}'
+        self.aws.shares[arn] = {
+            'name': name,
+            'owner': (self.account, self.region),
+            'status': 'ACTIVE',
+            'resources': set(),
+            'principals': {}
+        }
+        self.associate(self.aws.shares[arn], resourceArns, principals)
+        return {'resourceShare': {'resourceShareArn': arn, 'name': name}}
+
+    def op_associate_resource_share(self, resourceShareArn,
+                                    resourceArns=(), principals=()):
+        self.associate(self.aws.shares[resourceShareArn], resourceArns,
+                       principals)
+        return {}
+
+    def op_get_resource_share_invitations(self, resourceShareArns):
+        invitations = []
+        for arn in resourceShareArns:
+            status = self.aws.shares[arn]['principals'].get(self.account)
+            if status is not None:
+                invitations.append({
+                    'resourceShareInvitationArn': f'{arn}/{self.account}',
+                    'status': 'PENDING' if status == 'PENDING'
+                    else 'ACCEPTED'})
+        return {'resourceShareInvitations': invitations}
+
+    def op_accept_resource_share_invitation(self,
+                                            resourceShareInvitationArn):
+        arn, account = resourceShareInvitationArn.rsplit('/', 1)
+        self.aws.shares[arn]['principals'][account] = 'ASSOCIATED'
+        return {}
+
+    def op_get_resource_share_associations(self, associationType,
+                                           resourceShareArns):
+        share = self.aws.shares[resourceShareArns[0]]
+        ready = time.monotonic() >= share['associated']
+        if associationType == 'PRINCIPAL':
+            return {'resourceShareAssociations': [
+                {'associatedEntity': principal,
+                 'status': status if ready else 'ASSOCIATING'}
+                for principal, status in share['principals'].items()]}
+        return {'resourceShareAssociations': [
+            {'associatedEntity': resource,
+             'status': 'ASSOCIATED' if ready else 'ASSOCIATING'}
+            for resource in share['resources']]}
+
+    def op_delete_resource_share(self, resourceShareArn):
+        self.aws.shares[resourceShareArn]['status'] = 'DELETED'
+        return {}
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from benchmarks.fake_aws import FakeAWS  # noqa: E402
+from utils import iam, kms, metrics, ratelimit, rds, waiter  # noqa: E402
+from utils.args import setup_args  # noqa: E402
+from rds_backup import run  # noqa: E402
+
+ACCOUNTS = {
+    'prod': '111111111111',
+    'dev': '222222222222',
+    'exp': '333333333333'
+}
+REGIONS = ['ap-southeast-2', 'us-east-1']
+# instances hook commands run on in each account and region
+FLEET_SIZE = 300
+
+COMMON_ARGS = [
+    '--source-account', 'prod',
+    '--source-snapshot-name', 'bench',
+    '--instance-type', 'db.t3.small',
+    '--dest-kms-key', 'alias/rds',
+    '--ssm-security-group', 'shared.DB_SECURITY_GROUP'
+]
+
+# scenarios restore the source instance unless they name another source
+DEFAULT_SOURCE = ['--source-instance', 'db']
+
+SCENARIOS = {
+    'single': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench']
+    },
+    'fanout': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'ap-southeast-2',
+                 '--dest-account', 'exp', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'ap-southeast-2',
+                 '--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'us-east-1',
+                 '--dest-account', 'exp', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'us-east-1']
+    },
+    'swap': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--swap']
+    },
+    'hooks': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench',
+                 '--pre-restore-ssm-command', 'StopCron',
+                 '--pre-restore-ssm-instance-names', 'web',
+                 '--pre-restore-ssm-stage', '0',
+                 '--pre-restore-ssm-command', 'StopQueue',
+                 '--pre-restore-ssm-instance-names', 'worker',
+                 '--pre-restore-ssm-stage', '0',
+                 '--post-restore-ssm-command', 'StartCron',
+                 '--post-restore-ssm-instance-names', 'web',
+                 '--post-restore-ssm-stage', '0',
+                 '--post-restore-ssm-command', 'StartQueue',
+                 '--post-restore-ssm-instance-names', 'worker',
+                 '--post-restore-ssm-stage', '0',
+                 '--ssm-max-concurrency', '100', '--ssm-max-errors', '0'] +
+        [arg for n in range(10) for arg in [
+            '--pre-restore-asg-suspend-action', 'all',
+            '--pre-restore-asg-name', f'asg-{n}',
+            '--post-restore-asg-resume-action', 'all',
+            '--post-restore-asg-name', f'asg-{n}']]
+    },
+    'clone': {
+        'source': ['--source-cluster', 'cluster', '--clone',
+                   '--ssm-cluster-parameter-group',
+                   'lapis.DB_CLUSTER_PARAMETER_GROUP'],
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'cluster',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'ap-southeast-2',
+                 '--dest-account', 'exp', '--dest-instance', 'cluster',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'ap-southeast-2',
+                 '--dest-account', 'dev', '--dest-instance', 'cluster',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'us-east-1']
+    },
+    'point_in_time': {
+        'argv': ['--dest-account', 'prod', '--dest-instance', 'db-refresh',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'ap-southeast-2',
+                 '--dest-account', 'prod', '--dest-instance', 'db-refresh',
+                 '--dest-snapshot-name', 'bench', '--dest-region',
+                 'us-east-1']
+    },
+    'boost': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--warm',
+                 '--warm-ssm-instance-name', 'bastion',
+                 '--boost-instance-type', 'db.r6g.4xlarge',
+                 '--boost-storage-type', 'io1', '--boost-iops', '20000']
+    },
+    'warm': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--warm',
+                 '--warm-ssm-instance-name', 'bastion']
+    },
+    'throttled': {
+        'argv': ['--dest-account', 'dev', '--dest-instance', 'db',
+                 '--dest-snapshot-name', 'bench', '--dest-account', 'exp',
+                 '--dest-instance', 'db', '--dest-snapshot-name', 'bench'],
+        'throttle_rate': 0.2
+    }
+}
+
+
+def setup_benchmark_args():
+    parser = argparse.ArgumentParser(
+        description='Run restores against a fake AWS backend and check them '
+                    'against performance thresholds')
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        choices=sorted(SCENARIOS),
+        help='Scenario to run, defaults to all of them')
+    parser.add_argument(
+        '--latency-scale',
+        type=float,
+        default=1.0,
+        help='Multiply every simulated AWS latency by this')
+    parser.add_argument(
+        '--throttle-rate',
+        type=float,
+        help='Fraction of API attempts the fake throttles, overrides the '
+             'scenario')
+    parser.add_argument(
+        '--thresholds',
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'thresholds.json'),
+        help='JSON file of per scenario thresholds')
+    parser.add_argument(
+        '--report',
+        help='File to write the JSON results to')
+    parser.add_argument(
+        '--log-level',
+        default='error',
+        help='Log level')
+    return parser.parse_args()
+
+
+def build_fake(latency_scale, throttle_rate):
+    fake = FakeAWS(throttle_rate=throttle_rate)
+    fake.latencies = {k: v * latency_scale for k, v in fake.latencies.items()}
+    for account_id in ACCOUNTS.values():
+        for region in REGIONS:
+            fake.add_key(account_id, region, f'key-{account_id}',
+                         aliases=['alias/rds'])
+            fake.add_instance(
+                account_id, region, 'db',
+                KmsKeyId=f'arn:aws:kms:{region}:{account_id}:key/'
+                         f'key-{account_id}')
+            fake.add_cluster(
+                account_id, region, 'cluster',
+                KmsKeyId=f'arn:aws:kms:{region}:{account_id}:key/'
+                         f'key-{account_id}')
+            if region != REGIONS[0]:
+                fake.replicate_backups(account_id, REGIONS[0], 'db', region)
+            fake.add_fleet(account_id, region, 'web', FLEET_SIZE)
+            fake.add_fleet(account_id, region, 'worker', FLEET_SIZE)
+            fake.add_fleet(account_id, region, 'bastion', 1)
+            for name in ['lapis.DB_PASSWORD',
+                         'shared.PRIVATE_RDS_SUBNET_GROUP',
+                         'shared.POSTGRES_96_OPTION_GROUP',
+                         'lapis.DB_PARAMETER_GROUP',
+                         'lapis.DB_CLUSTER_PARAMETER_GROUP',
+                         'shared.DB_SECURITY_GROUP']:
+                fake.add_parameter(account_id, region, name, name.lower())
+    return fake
+
+
+def reset_state(fake):
+    # each scenario starts cold, as a fresh process would
+    iam.session_factory = fake.session
+    # credentials cached on disk by an earlier scenario would skip STS
+    iam.creds_cache_path = None
+    iam.accounts = {name: f'arn:aws:iam::{account_id}:role/Benchmark'
+                    for name, account_id in ACCOUNTS.items()}
+    iam.reset_caches()
+    with rds.pollers_lock:
+        rds.pollers.clear()
+    with kms.keys_lock:
+        kms.keys.clear()
+    with ratelimit.lock:
+        ratelimit.buckets.clear()
+        ratelimit.throttles.clear()
+    metrics.reset()
+
+
+def get_peak_concurrency(spans):
+    events = []
+    for span in spans:
+        if span['end'] is None or span['status'] == 'resumed':
+            continue
+        events += [(span['start'], 1), (span['end'], -1)]
+    peak = running = 0
+    # ends sort before starts at the same instant
+    for _, change in sorted(events):
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def run_scenario(name, scenario, options):
+    throttle_rate = scenario.get('throttle_rate', 0.0)
+    if options.throttle_rate is not None:
+        throttle_rate = options.throttle_rate
+    fake = build_fake(options.latency_scale, throttle_rate)
+    reset_state(fake)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = scenario.get('source', DEFAULT_SOURCE)
+        args = setup_args(COMMON_ARGS + source + scenario['argv'] + [
+            '--journal-file', os.path.join(directory, 'journal.json'),
+            '--history-file', os.path.join(directory, 'history.json')])
+        start = time.monotonic()
+        run(args)
+        seconds = time.monotonic() - start
+
+    trace = metrics.get_trace()
+    return {
+        'seconds': round(seconds, 2),
+        'api_calls': {service: stats['calls']
+                      for service, stats in sorted(trace['api'].items())},
+        'api_retries': {service: stats['retries']
+                        for service, stats in sorted(trace['api'].items())},
+        'peak_steps': get_peak_concurrency(trace['spans']),
+        'peak_api_calls': fake.peak_in_flight
+    }
+
+
+def check_thresholds(name, result, thresholds):
+    failures = []
+    if 'max_seconds' in thresholds and \
+            result['seconds'] > thresholds['max_seconds']:
+        failures.append(f'{name} took {result["seconds"]}s, more than '
+                        f'{thresholds["max_seconds"]}s')
+    for service, limit in thresholds.get('max_api_calls', {}).items():
+        calls = result['api_calls'].get(service, 0)
+        if calls > limit:
+            failures.append(f'{name} made {calls} {service} calls, more '
+                            f'than {limit}')
+    if 'min_peak_steps' in thresholds and \
+            result['peak_steps'] < thresholds['min_peak_steps']:
+        failures.append(f'{name} ran at most {result["peak_steps"]} steps '
+                        f'at once, fewer than {thresholds["min_peak_steps"]}')
+    return failures
+
+
+def main():
+    options = setup_benchmark_args()
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, options.log_level.upper()))
+
+    # simulated AWS latencies are in seconds rather than minutes, poll to
+    # match
+    waiter.configure(min_delay=0.05 * options.latency_scale,
+                     max_delay=0.5 * options.latency_scale)
+    rds.STATUS_CHANGE_DELAY = 0.2 * options.latency_scale
+
+    with open(options.thresholds) as f:
+        thresholds = json.load(f)
+
+    results = {}
+    failures = []
+    for name in options.scenario or sorted(SCENARIOS):
+        results[name] = run_scenario(name, SCENARIOS[name], options)
+        failures += check_thresholds(name, results[name],
+                                     thresholds.get(name, {}))
+        print(f'{name}: {results[name]["seconds"]}s, '
+              f'{sum(results[name]["api_calls"].values())} API calls '
+              f'{results[name]["api_calls"]}, '
+              f'{sum(results[name]["api_retries"].values())} retries, '
+              f'peak {results[name]["peak_steps"]} steps and '
+              f'{results[name]["peak_api_calls"]} API calls in flight')
+
+    if options.report:
+        with open(options.report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    for failure in failures:
+        print(f'REGRESSION: {failure}')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
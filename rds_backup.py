@@ -1,150 +1,893 @@
 #!/usr/bin/env python3
 
 import logging
-from utils.iam import assume_role, iam_init
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from utils.iam import iam_init, get_cache_stats
 from utils.args import setup_args
+from utils.dag import StepGraph
+from utils.journal import Journal
+from utils.history import History
+from utils.ratelimit import configure_rate_limits, get_throttle_counts
+from utils import metrics, waiter
 from utils.rds import create_rds_snapshot, share_rds_snapshot, \
     copy_rds_snapshot, restore_db_from_snapshot, modify_db_instance, \
-    reboot_db_instance, get_rds_instance_kms_key
-from utils.kms import share_kms_key, unshare_kms_key
-from utils.ssm import get_parameter, run_command
-from utils.asg import suspend_asg_action, resume_asg_action
+    reboot_db_instance, get_rds_instance_kms_key, \
+    get_rds_snapshot, find_recent_rds_snapshot, prune_rds_snapshots, \
+    get_rds_instance, rename_db_instance, delete_rds_instance, \
+    rds_instance_needs_reboot, get_rds_cluster, get_rds_cluster_snapshot, \
+    create_rds_cluster_snapshot, share_rds_cluster_snapshot, \
+    copy_rds_cluster_snapshot, restore_db_cluster_from_snapshot, \
+    clone_db_cluster, create_cluster_instance, modify_db_cluster, \
+    restore_db_to_point_in_time, get_automated_backups, tag_db_instance, \
+    resize_db_instance, LINEAGE_TAG, READY_TAG
+from utils.ram import share_resource, accept_resource_share, \
+    wait_for_resource_share, delete_resource_share
+from utils.kms import share_kms_key, unshare_kms_key, describe_key
+from utils.ssm import get_parameters, run_command_stages
+from utils.asg import suspend_asg_actions, resume_asg_actions
+from utils.warm import warm_db_instance, warm_db_instance_ssm
 
+DEST_STEPS = [
+    'dest_kms_key',
+    'copy',
+    'prune_snapshots',
+    'parameters',
+    'pre_restore_hooks',
+    'restore',
+    'modify',
+    'reboot',
+    'warm',
+    'downgrade',
+    'swap',
+    'post_restore_hooks'
+]
 
-def main():
-    args = setup_args()
-    iam_init()
 
-    # setup logging
-    logger = logging.getLogger()
-    logger.setLevel(getattr(logging, args.log_level.upper()))
+def get_source_identifier(args):
+    return args.source_cluster or args.source_instance
+
+
+def uses_clone(args, dest):
+    # clusters can only be cloned within a region
+    return args.clone and args.source_region == dest['region']
+
+
+def uses_point_in_time(args, dest):
+    # destinations in the source account restore from the source's automated
+    # backups, in other regions only when the backups are replicated there
+    return args.source_cluster is None and not args.no_point_in_time and \
+        dest['account'] == args.source_account and \
+        dest['region'] in args.automated_backups
+
+
+def boosts_storage(args):
+    return args.boost_storage_type is not None or \
+        args.boost_iops is not None or \
+        args.boost_storage_throughput is not None
+
+
+def uses_boost(args):
+    # restore onto a bigger instance and faster storage, then downgrade
+    return args.boost_instance_type is not None or boosts_storage(args)
+
+
+def get_restore_profile(args):
+    # the instance class and storage destinations are restored with
+    profile = {
+        'db_instance_type': args.boost_instance_type or args.instance_type,
+        'storage_type': args.storage_type,
+        'iops': args.iops,
+        'storage_throughput': args.storage_throughput
+    }
+    if boosts_storage(args):
+        storage_type = args.boost_storage_type or args.storage_type
+        iops = args.boost_iops
+        # provisioned IOPS storage can't go without, use the target's
+        if iops is None and storage_type in ('io1', 'io2'):
+            iops = args.iops
+        profile.update({
+            'storage_type': storage_type,
+            'iops': iops,
+            'storage_throughput': args.boost_storage_throughput
+        })
+    return profile
+
+
+def get_ready_step(args):
+    # the last step before a restored DB is ready to take traffic
+    if uses_boost(args):
+        return 'downgrade'
+    if args.warm:
+        return 'warm'
+    return 'reboot'
+
+
+def needs_snapshot(args):
+    return any(not uses_clone(args, dest) and
+               not uses_point_in_time(args, dest)
+               for dest in args.destinations)
+
+
+def needs_copy(args, dest):
+    return not uses_clone(args, dest) and \
+        not uses_point_in_time(args, dest) and (
+            args.source_account != dest['account'] or
+            args.source_region != dest['region'])
+
+
+def get_share_accounts(args, clone=None):
+    # accounts the source is shared with, limited to destinations that clone
+    # or that restore from the snapshot when clone is given
+    return sorted(set(
+        dest['account'] for dest in args.destinations
+        if dest['account'] != args.source_account and
+        (clone is None or uses_clone(args, dest) == clone)))
+
+
+def get_run_key(args):
+    # a run restoring to another point in time is a different run
+    restore_time = []
+    if args.restore_time is not None:
+        restore_time = [args.restore_time.isoformat()]
+    return ' '.join([f'{args.source_account}/{args.source_region}/'
+                     f'{get_source_identifier(args)}',
+                     args.source_snapshot_name] + restore_time +
+                    [f'{dest["name"]}/{dest["snapshot_name"]}'
+                     for dest in args.destinations])
+
+
+def snapshot_available(args, account, region, snapshot_name):
+    if args.source_cluster is not None:
+        snapshot = get_rds_cluster_snapshot(account, region, snapshot_name)
+    else:
+        snapshot = get_rds_snapshot(account, region, snapshot_name)
+    return snapshot is not None and snapshot['Status'] == 'available'
+
+
+def verify_source_snapshot(args, result):
+    return snapshot_available(args, args.source_account, args.source_region,
+                              result or args.source_snapshot_name)
+
+
+def verify_dest_snapshot(args, dest, result):
+    return snapshot_available(args, dest['account'], dest['region'],
+                              result or dest['snapshot_name'])
+
+
+def verify_restored_instance(args, dest, result):
+    if args.source_cluster is not None:
+        cluster = get_rds_cluster(dest['account'], dest['region'],
+                                  dest['instance'])
+        return cluster is not None and \
+            str(cluster.get('ClusterCreateTime')) == result
+
+    # restore steps return the restored instance's creation time, which
+    # survives the rename in swap mode
+    for db_instance in {get_restore_instance(args, dest), dest['instance']}:
+        instance = get_rds_instance(dest['account'], dest['region'],
+                                    db_instance)
+        if instance is not None and \
+                str(instance.get('InstanceCreateTime')) == result:
+            return True
+    return False
+
+
+def verify_completed(*args):
+    return True
+
+
+def get_snapshot_names(args, results):
+    # when retaining snapshots every run gets new names, previous copies are
+    # left in place so RDS can copy incrementally
+    suffix = ''
+    if args.retain_snapshots is not None:
+        suffix = datetime.now(tz=timezone.utc).strftime('-%Y%m%d%H%M%S')
+    names = {'source': args.source_snapshot_name + suffix}
+    for dest in args.destinations:
+        names[dest['name']] = dest['snapshot_name'] + suffix
+    return names
+
+
+def get_lineage_tags(args, lineage):
+    if args.retain_snapshots is None:
+        return None
+    return {LINEAGE_TAG: lineage}
+
+
+def create_snapshot(args, results):
+    # returns the identifier of the source snapshot the rest of the run uses
+    snapshot_name = results['snapshot_names']['source']
+    if args.max_snapshot_age is not None:
+        snapshot = find_recent_rds_snapshot(
+            account=args.source_account,
+            region=args.source_region,
+            db_instance=args.source_instance,
+            max_age=args.max_snapshot_age)
+        if snapshot is not None:
+            logging.warning(f'Using {snapshot["SnapshotType"]} snapshot '
+                            f'{snapshot["DBSnapshotIdentifier"]} taken at '
+                            f'{snapshot["SnapshotCreateTime"]}')
+            # automated snapshots can't be shared, so they only need copying
+            # to a manual snapshot when another account needs them
+            if snapshot['SnapshotType'] == 'manual' or \
+                    not len(get_share_accounts(args)):
+                return snapshot['DBSnapshotIdentifier']
+            copy_rds_snapshot(
+                source_account=args.source_account,
+                source_region=args.source_region,
+                dest_account=args.source_account,
+                region=args.source_region,
+                snapshot_name=snapshot['DBSnapshotIdentifier'],
+                dest_snapshot_name=snapshot_name,
+                wait=True,
+                tags=get_lineage_tags(args, args.source_snapshot_name))
+            return snapshot_name
+        logging.warning(f'No snapshot of {args.source_instance} newer than '
+                        f'{args.max_snapshot_age} minutes, taking a new one')
+
+    if args.source_cluster is not None:
+        create_rds_cluster_snapshot(
+            account=args.source_account,
+            region=args.source_region,
+            db_cluster=args.source_cluster,
+            snapshot_name=snapshot_name,
+            wait=True,
+            expected_duration=args.estimates.get('create_snapshot'))
+        return snapshot_name
 
-    # create snapshot
     create_rds_snapshot(
         account=args.source_account,
         region=args.source_region,
         db_instance=args.source_instance,
-        snapshot_name=args.source_snapshot_name,
-        wait=True)
+        snapshot_name=snapshot_name,
+        wait=True,
+        tags=get_lineage_tags(args, args.source_snapshot_name),
+        expected_duration=args.estimates.get('create_snapshot'))
+    return snapshot_name
+
+
+def prune_source_snapshots(args, results):
+    prune_rds_snapshots(args.source_account, args.source_region,
+                        args.source_snapshot_name, args.retain_snapshots)
+
+
+def prune_dest_snapshots(args, dest, results):
+    prune_rds_snapshots(dest['account'], dest['region'],
+                        dest['snapshot_name'], args.retain_snapshots)
 
-    # share snapshot with dest account
-    share_rds_snapshot(
-        args.source_account,
-        args.source_region,
-        args.source_snapshot_name, args.dest_account)
 
-    # if kms key provided in args, share with destination account temporarily
-    source_kms_key = get_rds_instance_kms_key(
+def share_snapshot(args, results):
+    share_accounts = get_share_accounts(args, clone=False)
+    if not len(share_accounts):
+        return
+    share = share_rds_snapshot
+    if args.source_cluster is not None:
+        share = share_rds_cluster_snapshot
+    share(args.source_account, args.source_region,
+          results['create_snapshot'], share_accounts)
+
+
+def get_resource_share_name(args):
+    return f'rds-restore-{args.source_account}-{args.source_cluster}'
+
+
+def share_source_cluster(args, results):
+    # other accounts can only clone the cluster once it's shared with them
+    # through RAM
+    share_accounts = get_share_accounts(args, clone=True)
+    cluster = get_rds_cluster(args.source_account, args.source_region,
+                              args.source_cluster)
+    share_arn = share_resource(
+        args.source_account, args.source_region,
+        get_resource_share_name(args), cluster['DBClusterArn'],
+        share_accounts)
+    for account in share_accounts:
+        accept_resource_share(account, args.source_region, share_arn)
+    wait_for_resource_share(args.source_account, args.source_region,
+                            share_arn)
+    return share_arn
+
+
+def unshare_source_cluster(args, results):
+    # clones keep working once the share is gone
+    if results.get('share_cluster') is None:
+        return
+    delete_resource_share(args.source_account, args.source_region,
+                          results['share_cluster'])
+
+
+def get_source_kms_key(args, results):
+    if args.source_cluster is not None:
+        key = get_rds_cluster(args.source_account, args.source_region,
+                              args.source_cluster).get('KmsKeyId')
+    else:
+        key = get_rds_instance_kms_key(
+            account=args.source_account,
+            region=args.source_region,
+            db_instance=args.source_instance)
+    if key is None:
+        return None
+    return describe_key(args.source_account, args.source_region, key)['Arn']
+
+
+def get_dest_kms_key(args, dest, results):
+    if not args.dest_kms_key:
+        return None
+    return describe_key(dest['account'], dest['region'],
+                        args.dest_kms_key)['Arn']
+
+
+def share_source_kms_key(args, results):
+    share_accounts = get_share_accounts(args)
+    source_kms_key = results['source_kms_key']
+    if not len(share_accounts) or source_kms_key is None:
+        return False
+    share_kms_key(
         account=args.source_account,
         region=args.source_region,
-        db_instance=args.source_instance)
+        share_accounts=share_accounts,
+        key=source_kms_key)
+    return True
+
+
+def unshare_source_kms_key(args, results):
+    if not results.get('share_kms_key'):
+        return
+    unshare_kms_key(
+        account=args.source_account,
+        region=args.source_region,
+        share_accounts=get_share_accounts(args),
+        key=results['source_kms_key'])
 
-    if args.source_account != args.dest_account:
-        if source_kms_key is not None:
-            share_kms_key(
-                account=args.source_account,
-                region=args.source_region,
-                share_accounts=args.dest_account,
-                key=source_kms_key)
 
-    # copy snapshot to destination account
+def copy_snapshot(args, dest, results):
+    dest_snapshot_name = results['snapshot_names'][dest['name']]
     copy_args = {
         'source_account': args.source_account,
         'source_region': args.source_region,
-        'dest_account': args.dest_account,
-        'region': args.dest_region,
-        'snapshot_name': args.source_snapshot_name,
-        'dest_snapshot_name': args.dest_snapshot_name,
-        'wait': True
+        'dest_account': dest['account'],
+        'region': dest['region'],
+        'snapshot_name': results['create_snapshot'],
+        'dest_snapshot_name': dest_snapshot_name,
+        'wait': True,
+        'tags': get_lineage_tags(args, dest['snapshot_name']),
+        'expected_duration': args.estimates.get(f'copy:{dest["name"]}')
     }
-    if args.dest_kms_key:
-        copy_args['kms_key'] = args.dest_kms_key
-    if args.source_account != args.dest_account or \
-            args.source_region != args.dest_region:
+    if results[f'dest_kms_key:{dest["name"]}'] is not None:
+        copy_args['kms_key'] = results[f'dest_kms_key:{dest["name"]}']
+    if args.source_cluster is not None:
+        copy_rds_cluster_snapshot(**copy_args)
+    else:
         copy_rds_snapshot(**copy_args)
+    return dest_snapshot_name
 
-    # unshare kms key now that snapshot is copied
-    if args.source_account != args.dest_account:
-        if source_kms_key is not None:
-            unshare_kms_key(
-                account=args.source_account,
-                region=args.source_region,
-                share_accounts=args.dest_account,
-                key=source_kms_key)
-
-    # run any asg pre restore suspend actions
-    if len(args.pre_restore_asg_suspend_action):
-        for idx, action in enumerate(args.pre_restore_asg_suspend_action):
-            suspend_asg_action(
-                args.dest_account,
-                args.dest_region,
-                action,
-                args.pre_restore_asg_name[idx])
-
-    # run any SSM pre restore commands
-    if len(args.pre_restore_ssm_command):
-        for idx, command in enumerate(args.pre_restore_ssm_command):
-            run_command(
-                args.dest_account,
-                args.dest_region,
-                command,
-                args.pre_restore_ssm_instance_names[idx])
-
-    # restore snapshot in destination account
-    restore_db_from_snapshot(
-        account=args.dest_account,
-        region=args.dest_region,
-        snapshot_name=args.dest_snapshot_name,
-        db_instance=args.dest_instance,
+
+def resolve_parameters(args, dest, results):
+    # resolve everything up front so a missing parameter fails the run before
+    # anything in the destination is touched
+    names = [args.ssm_subnet_group, args.ssm_option_group,
+             args.ssm_db_password, args.ssm_parameter_group] + \
+        args.ssm_security_group
+    for name in [args.ssm_cluster_parameter_group,
+                 args.ssm_cluster_instance_parameter_group]:
+        if name is not None:
+            names.append(name)
+    values = get_parameters(dest['account'], dest['region'], names,
+                            args.parameters)
+    return {
+        'subnet_group': values[args.ssm_subnet_group],
+        'option_group': values[args.ssm_option_group],
+        'security_groups': [values[sg] for sg in args.ssm_security_group],
+        'master_password': values[args.ssm_db_password],
+        'parameter_group': values[args.ssm_parameter_group],
+        'cluster_parameter_group':
+            values.get(args.ssm_cluster_parameter_group),
+        'cluster_instance_parameter_group':
+            values.get(args.ssm_cluster_instance_parameter_group)
+    }
+
+
+def get_hook_commands(commands, instance_names, stages):
+    # commands without stages each get their own, so they run in order
+    if not len(stages):
+        stages = range(len(commands))
+    return list(zip(stages, commands, instance_names))
+
+
+def pre_restore_hooks(args, dest, results):
+    # suspend every asg at once, then run the SSM pre restore commands
+    suspend_asg_actions(
+        dest['account'],
+        dest['region'],
+        list(zip(args.pre_restore_asg_suspend_action,
+                 args.pre_restore_asg_name)))
+
+    run_command_stages(
+        dest['account'],
+        dest['region'],
+        get_hook_commands(args.pre_restore_ssm_command,
+                          args.pre_restore_ssm_instance_names,
+                          args.pre_restore_ssm_stage),
+        max_concurrency=args.ssm_max_concurrency,
+        max_errors=args.ssm_max_errors)
+
+
+def get_restore_instance(args, dest):
+    # when restoring a cluster this is its writer instance
+    if args.source_cluster is not None:
+        return f'{dest["instance"]}-writer'
+    # in swap mode the restore goes to a temporary instance while the
+    # existing one keeps serving
+    if args.swap:
+        return f'{dest["instance"]}-swap'
+    return dest['instance']
+
+
+def restore_snapshot(args, dest, results):
+    parameters = results[f'parameters:{dest["name"]}']
+    restore_args = dict(get_restore_profile(args), **{
+        'account': dest['account'],
+        'region': dest['region'],
+        'db_instance': get_restore_instance(args, dest),
+        'subnet_group': parameters['subnet_group'],
+        'multi_az': args.multi_az,
+        'public': args.public,
+        'option_group': parameters['option_group'],
+        'vpc_security_groups': parameters['security_groups'],
+        'parameter_group': parameters['parameter_group'],
+        'tags': args.tags,
+        'wait': True,
+        'expected_duration': args.estimates.get(f'restore:{dest["name"]}')
+    })
+    if uses_point_in_time(args, dest):
+        restore_db_to_point_in_time(
+            source_db_instance=args.source_instance,
+            source_backups_arn=args.automated_backups[dest['region']],
+            restore_time=args.restore_time,
+            **restore_args)
+    else:
+        if needs_copy(args, dest):
+            snapshot_name = results[f'copy:{dest["name"]}']
+        else:
+            snapshot_name = results['create_snapshot']
+        restore_db_from_snapshot(snapshot_name=snapshot_name, **restore_args)
+
+    instance = get_rds_instance(dest['account'], dest['region'],
+                                get_restore_instance(args, dest))
+    metrics.add_counter('restored_storage_bytes',
+                        instance['AllocatedStorage'] * 1024 ** 3)
+    return str(instance.get('InstanceCreateTime'))
+
+
+def restore_cluster(args, dest, results):
+    # restores or clones the cluster, then adds its writer instance
+    parameters = results[f'parameters:{dest["name"]}']
+    restore_args = {
+        'account': dest['account'],
+        'region': dest['region'],
+        'db_cluster': dest['instance'],
+        'subnet_group': parameters['subnet_group'],
+        'vpc_security_groups': parameters['security_groups'],
+        'parameter_group': parameters['cluster_parameter_group'],
+        'kms_key': results.get(f'dest_kms_key:{dest["name"]}'),
+        'tags': args.tags,
+        'wait': True,
+        'expected_duration': args.estimates.get(f'restore:{dest["name"]}')
+    }
+    if uses_clone(args, dest):
+        source_arn = get_rds_cluster(
+            args.source_account, args.source_region,
+            args.source_cluster)['DBClusterArn']
+        clone_db_cluster(source_cluster_arn=source_arn, **restore_args)
+    else:
+        if needs_copy(args, dest):
+            snapshot_name = results[f'copy:{dest["name"]}']
+        else:
+            snapshot_name = results['create_snapshot']
+        # the copy was already encrypted with the destination key
+        restore_args['kms_key'] = None
+        restore_db_cluster_from_snapshot(snapshot_name=snapshot_name,
+                                         **restore_args)
+
+    create_cluster_instance(
+        account=dest['account'],
+        region=dest['region'],
+        db_cluster=dest['instance'],
+        db_instance=get_restore_instance(args, dest),
         db_instance_type=args.instance_type,
-        subnet_group=get_parameter(args.dest_account, args.dest_region,
-                                   args.ssm_subnet_group),
-        multi_az=args.multi_az,
         public=args.public,
-        option_group=get_parameter(args.dest_account, args.dest_region,
-                                   args.ssm_option_group),
-        storage_type=args.storage_type,
+        # the instance group is for non-Aurora engines, Aurora instances
+        # take their own or the engine default
+        parameter_group=parameters['cluster_instance_parameter_group'],
+        tags=args.tags,
         wait=True)
+    cluster = get_rds_cluster(dest['account'], dest['region'],
+                              dest['instance'])
+    metrics.add_counter('restored_storage_bytes',
+                        cluster['AllocatedStorage'] * 1024 ** 3)
+    return str(cluster.get('ClusterCreateTime'))
 
-    # reset password, security groups etc
-    db_security_groups = [
-        get_parameter(args.dest_account, args.dest_region, sg) for sg in
-        args.ssm_security_group]
+
+def modify_instance(args, dest, results):
+    parameters = results[f'parameters:{dest["name"]}']
+    if args.source_cluster is not None:
+        modify_db_cluster(
+            account=dest['account'],
+            region=dest['region'],
+            db_cluster=dest['instance'],
+            master_password=parameters['master_password'],
+            wait=True)
+        return results[f'restore:{dest["name"]}']
+
+    # everything else was applied by the restore, the password can't be
     modify_db_instance(
-        account=args.dest_account,
-        region=args.dest_region,
-        db_instance=args.dest_instance,
-        db_security_groups=db_security_groups,
-        master_password=get_parameter(args.dest_account, args.dest_region,
-                                      args.ssm_db_password),
-        parameter_group=get_parameter(args.dest_account, args.dest_region,
-                                      args.ssm_parameter_group),
+        account=dest['account'],
+        region=dest['region'],
+        db_instance=get_restore_instance(args, dest),
+        master_password=parameters['master_password'],
         wait=True)
+    return results[f'restore:{dest["name"]}']
+
 
-    # reboot instance to apply final changes
+def reboot_instance(args, dest, results):
+    if not rds_instance_needs_reboot(dest['account'], dest['region'],
+                                     get_restore_instance(args, dest)):
+        logging.warning(f'DB {get_restore_instance(args, dest)} has no '
+                        f'changes pending a reboot, not rebooting')
+        return results[f'restore:{dest["name"]}']
     reboot_db_instance(
-        account=args.dest_account,
-        region=args.dest_region,
-        db_instance=args.dest_instance,
+        account=dest['account'],
+        region=dest['region'],
+        db_instance=get_restore_instance(args, dest),
         wait=True)
+    return results[f'restore:{dest["name"]}']
+
+
+def mark_ready(args, dest):
+    # a warmed DB is ready once it's also back on its target class and
+    # storage, see get_ready_step
+    tag_db_instance(dest['account'], dest['region'],
+                    get_restore_instance(args, dest),
+                    {READY_TAG: datetime.now(tz=timezone.utc).isoformat()})
+
+
+def warm_instance(args, dest, results):
+    # a restored DB loads each block from S3 the first time it's read, read
+    # them all now so the first queries after the refresh aren't slow
+    db_instance = get_restore_instance(args, dest)
+    instance = get_rds_instance(dest['account'], dest['region'], db_instance)
+    if not instance['Engine'].startswith('postgres'):
+        raise ValueError(f"Warming {instance['Engine']} DB {db_instance} "
+                         "isn't supported")
+    if args.warm_ssm_instance_name is not None:
+        warm_db_instance_ssm(dest['account'], dest['region'], instance,
+                             args.ssm_db_password,
+                             args.warm_ssm_instance_name, args.warm_workers)
+    else:
+        warm_db_instance(
+            instance,
+            results[f'parameters:{dest["name"]}']['master_password'],
+            args.warm_workers,
+            expected_duration=args.estimates.get(f'warm:{dest["name"]}'))
+    if get_ready_step(args) == 'warm':
+        mark_ready(args, dest)
+    return results[f'restore:{dest["name"]}']
+
+
+def downgrade_instance(args, dest, results):
+    # the boosted class and storage have done their job, resize to the
+    # target before the DB takes traffic
+    storage = {}
+    if boosts_storage(args):
+        storage = {
+            'storage_type': args.storage_type,
+            'iops': args.iops,
+            'storage_throughput': args.storage_throughput
+        }
+    resize_db_instance(
+        account=dest['account'],
+        region=dest['region'],
+        db_instance=get_restore_instance(args, dest),
+        db_instance_type=args.instance_type,
+        wait=True,
+        expected_duration=args.estimates.get(f'downgrade:{dest["name"]}'),
+        **storage)
+    if args.warm:
+        mark_ready(args, dest)
+    return results[f'restore:{dest["name"]}']
+
+
+def get_old_instance(dest, results):
+    # named after the restored instance's creation time, which the journal
+    # keeps, so a resumed swap finds the instance it renamed out of the way
+    created = datetime.fromisoformat(results[f'restore:{dest["name"]}'])
+    return dest['instance'] + created.strftime('-old-%Y%m%d%H%M%S')
+
+
+def swap_instances(args, dest, results):
+    account = dest['account']
+    region = dest['region']
+    new_instance = get_restore_instance(args, dest)
+    restored = results[f'restore:{dest["name"]}']
+    old_instance = get_old_instance(dest, results)
+
+    current = get_rds_instance(account, region, dest['instance'])
+    if current is not None and \
+            str(current.get('InstanceCreateTime')) == restored:
+        logging.warning(f'DB {new_instance} already swapped in for '
+                        f'{dest["instance"]}')
+    else:
+        instance = get_rds_instance(account, region, new_instance)
+        # a downgraded DB optimises its storage for hours, but serves
+        # meanwhile
+        if instance is None or instance['DBInstanceStatus'] not in (
+                'available', 'storage-optimization') or \
+                len(instance.get('PendingModifiedValues', {})):
+            raise ValueError(f'DB {new_instance} is not healthy, not '
+                             f'swapping it in for {dest["instance"]}')
+        # a resumed run may have renamed the old DB already
+        if current is not None:
+            rename_db_instance(account, region, dest['instance'],
+                               old_instance, wait=True)
+        rename_db_instance(account, region, new_instance, dest['instance'],
+                           wait=True)
+
+    # RDS deletes in the background, no need to wait for it
+    old = get_rds_instance(account, region, old_instance)
+    if old is not None and old['DBInstanceStatus'] != 'deleting':
+        delete_rds_instance(account, region, old_instance)
+    return restored
+
+
+def post_restore_hooks(args, dest, results):
+    # run the SSM post restore commands, then resume every asg at once
+    run_command_stages(
+        dest['account'],
+        dest['region'],
+        get_hook_commands(args.post_restore_ssm_command,
+                          args.post_restore_ssm_instance_names,
+                          args.post_restore_ssm_stage),
+        max_concurrency=args.ssm_max_concurrency,
+        max_errors=args.ssm_max_errors)
+
+    resume_asg_actions(
+        dest['account'],
+        dest['region'],
+        list(zip(args.post_restore_asg_resume_action,
+                 args.post_restore_asg_name)))
+
+
+def build_graph(args, journal=None):
+    graph = StepGraph(journal=journal)
+
+    def step(name, fn, deps=(), always=False, dest=None, verify=None):
+        if dest is None:
+            graph.add(name, partial(fn, args), deps, always,
+                      verify and partial(verify, args))
+            return
+        # per destination steps are suffixed with the destination name, as
+        # are their dependencies on other per destination steps
+        graph.add(f'{name}:{dest["name"]}', partial(fn, args, dest),
+                  [f'{d}:{dest["name"]}' if d in DEST_STEPS else d
+                   for d in deps], always,
+                  verify and partial(verify, args, dest))
+
+    step('snapshot_names', get_snapshot_names, verify=verify_completed)
+    if needs_snapshot(args):
+        # taking the snapshot replaces the last one of the same name, so a
+        # missing parameter has to fail the run before it starts
+        step('create_snapshot', create_snapshot,
+             ['snapshot_names'] + [f'parameters:{dest["name"]}'
+                                   for dest in args.destinations],
+             verify=verify_source_snapshot)
+        step('share_snapshot', share_snapshot, ['create_snapshot'])
+    step('source_kms_key', get_source_kms_key)
+    step('share_kms_key', share_source_kms_key, ['source_kms_key'])
+    if len(get_share_accounts(args, clone=True)):
+        step('share_cluster', share_source_cluster)
+
+    copies = []
+    clones = []
+    restore = restore_snapshot
+    if args.source_cluster is not None:
+        restore = restore_cluster
+    for dest in args.destinations:
+        # the source snapshot is restored directly when it's already in the
+        # destination account and region
+        restore_deps = ['parameters']
+        if not args.swap:
+            restore_deps.append('pre_restore_hooks')
+        if uses_clone(args, dest):
+            # clones read the source's storage, so the key stays shared
+            # until they're done
+            step('dest_kms_key', get_dest_kms_key, dest=dest)
+            restore_deps += ['share_kms_key', 'dest_kms_key']
+            if dest['account'] != args.source_account:
+                restore_deps.append('share_cluster')
+            clones.append(f'restore:{dest["name"]}')
+        elif uses_point_in_time(args, dest):
+            # restored straight from the source's automated backups
+            pass
+        elif needs_copy(args, dest):
+            step('dest_kms_key', get_dest_kms_key, dest=dest)
+            step('copy', copy_snapshot,
+                 ['share_snapshot', 'share_kms_key', 'parameters',
+                  'dest_kms_key'], dest=dest, verify=verify_dest_snapshot)
+            copies.append(f'copy:{dest["name"]}')
+            restore_deps.append('copy')
+            if args.retain_snapshots is not None:
+                step('prune_snapshots', prune_dest_snapshots, ['copy'],
+                     dest=dest)
+        else:
+            restore_deps.append('create_snapshot')
+
+        step('parameters', resolve_parameters, dest=dest)
+        # don't quiesce the destination until the source snapshot is taken,
+        # then overlap the hooks with the copy. When swapping the existing DB
+        # keeps serving, so only quiesce once the new one is ready
+        pre_restore_deps = ['create_snapshot', 'parameters']
+        if uses_clone(args, dest) or uses_point_in_time(args, dest):
+            pre_restore_deps = ['parameters']
+        if args.swap:
+            pre_restore_deps = [get_ready_step(args)]
+        step('pre_restore_hooks', pre_restore_hooks, pre_restore_deps,
+             dest=dest, verify=verify_completed)
+        step('restore', restore, restore_deps, dest=dest,
+             verify=verify_restored_instance)
+        step('modify', modify_instance, ['restore'], dest=dest,
+             verify=verify_restored_instance)
+        step('reboot', reboot_instance, ['modify'], dest=dest,
+             verify=verify_restored_instance)
+        if args.warm:
+            # the DB only counts as ready once it's warm
+            step('warm', warm_instance, ['reboot'], dest=dest,
+                 verify=verify_restored_instance)
+        if uses_boost(args):
+            step('downgrade', downgrade_instance,
+                 ['warm' if args.warm else 'reboot'], dest=dest,
+                 verify=verify_restored_instance)
+        post_restore_deps = [get_ready_step(args)]
+        if args.swap:
+            step('swap', swap_instances, ['pre_restore_hooks'],
+                 dest=dest, verify=verify_restored_instance)
+            post_restore_deps = ['swap']
+        step('post_restore_hooks', post_restore_hooks, post_restore_deps,
+             dest=dest, verify=verify_completed)
+
+    if args.retain_snapshots is not None and needs_snapshot(args):
+        step('prune_source_snapshots', prune_source_snapshots,
+             ['create_snapshot'] + copies)
+
+    # unshare kms key once every copy has finished, even if one failed
+    step('unshare_kms_key', unshare_source_kms_key,
+         ['share_kms_key'] + copies + clones, always=True)
+    if len(get_share_accounts(args, clone=True)):
+        step('unshare_cluster', unshare_source_cluster,
+             ['share_cluster'] + clones, always=True)
+    return graph
+
+
+def get_step_features(args, source, step):
+    # what drives how long a step takes, see utils.history
+    dest = None
+    if ':' in step:
+        dest = next(d for d in args.destinations
+                    if d['name'] == step.split(':', 1)[1])
+    features = {
+        'storage': source.get('AllocatedStorage'),
+        'engine': source.get('Engine'),
+        'instance_class':
+            get_restore_profile(args)['db_instance_type'] if dest is not None
+            else source.get('DBInstanceClass'),
+        'cross_region': dest is not None and
+        dest['region'] != args.source_region
+    }
+    # clones take minutes however big the cluster, keep them apart
+    if dest is not None and uses_clone(args, dest):
+        features['clone'] = True
+    # as do point in time restores, which replay logs rather than load a
+    # snapshot
+    if dest is not None and uses_point_in_time(args, dest):
+        features['point_in_time'] = True
+    return features
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    return str(timedelta(seconds=int(seconds)))
+
+
+def print_plan(args, graph, source):
+    schedule = graph.schedule()
+    print(f'Plan for {args.source_account}/{args.source_region}/'
+          f'{get_source_identifier(args)} ({source.get("AllocatedStorage")} '
+          f'GiB {source.get("Engine")}):')
+    print(f'  {"step":<48} {"start":>9} {"duration":>9}')
+    for name in sorted(graph.steps, key=lambda n: schedule[n]):
+        print(f'  {name:<48} {format_seconds(schedule[name][0]):>9} '
+              f'{format_seconds(graph.estimates.get(name)):>9}')
+    unknown = [name for name in graph.steps if name not in graph.estimates]
+    print(f'Estimated total: '
+          f'{format_seconds(max(end for _, end in schedule.values()))}' +
+          (f' ({len(unknown)} steps have no history)' if unknown else ''))
+
+
+def record_history(history, graph, features):
+    # resumed and failed steps say nothing about how long a step takes
+    for name, outcome in graph.outcomes.items():
+        if outcome == 'done':
+            start, end = graph.timings[name]
+            history.record(name, end - start, features[name])
+    history.save()
+
+
+def run(args, on_start=None):
+    # SSM values are only cached for this run
+    args.parameters = {}
+    if args.source_cluster is not None:
+        source = get_rds_cluster(args.source_account, args.source_region,
+                                 args.source_cluster) or {}
+    else:
+        source = get_rds_instance(args.source_account, args.source_region,
+                                  args.source_instance) or {}
+        args.automated_backups = get_automated_backups(source,
+                                                       args.source_region)
+    if args.restore_time is not None:
+        for dest in args.destinations:
+            if not uses_point_in_time(args, dest):
+                raise ValueError(f'No automated backups of '
+                                 f'{args.source_instance} in '
+                                 f'{dest["region"]} to restore '
+                                 f'{dest["instance"]} to --restore-time '
+                                 f'from')
+
+    graph = build_graph(args)
+    history = History(args.history_file)
+    features = {name: get_step_features(args, source, name)
+                for name in graph.steps}
+    for name in graph.steps:
+        estimate = history.estimate(name, features[name])
+        if estimate is not None:
+            args.estimates[name] = estimate
+    graph.estimates = args.estimates
+
+    if args.plan:
+        print_plan(args, graph, source)
+        return None
+
+    graph.journal = Journal(args.journal_file, get_run_key(args))
+    if not args.resume:
+        graph.journal.reset()
+    if on_start is not None:
+        on_start(graph)
+    try:
+        return graph.run()
+    finally:
+        record_history(history, graph, features)
+
+
+def main():
+    args = setup_args()
+    iam_init()
+
+    # setup logging
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+    configure_rate_limits(args.api_rate_limit)
+    waiter.configure(timeout=args.wait_timeout)
+
+    try:
+        run(args)
+    finally:
+        if args.trace_file:
+            metrics.write_trace(args.trace_file)
+        if args.metrics_file:
+            metrics.write_prometheus_metrics(args.metrics_file)
 
-    # run any SSM post restore commands
-    if len(args.post_restore_ssm_command):
-        for idx, command in enumerate(args.post_restore_ssm_command):
-            run_command(
-                args.dest_account,
-                args.dest_region,
-                command,
-                args.post_restore_ssm_instance_names[idx])
-
-    # run any asg post restore resume actions
-    if len(args.post_restore_asg_resume_action):
-        for idx, action in enumerate(args.post_restore_asg_resume_action):
-            resume_asg_action(
-                args.dest_account,
-                args.dest_region,
-                action,
-                args.post_restore_asg_name[idx])
+    logging.info(f'Client cache stats: {get_cache_stats()}')
+    logging.info(f'Throttled requests: {get_throttle_counts()}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import logging
+import argparse
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from utils.iam import iam_init, get_cache_stats
+from utils.args import setup_args, job_to_argv, rate_limit
+from utils.ratelimit import configure_rate_limits, get_throttle_counts
+from utils import metrics, waiter
+from rds_backup import run
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+def setup_batch_args():
+    parser = argparse.ArgumentParser(
+        description='Run many restores from a manifest in one process')
+    parser.add_argument(
+        '--manifest',
+        required=True,
+        help='JSON or YAML manifest of restore jobs')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of restore jobs to run at once')
+    parser.add_argument(
+        '--account-concurrency',
+        type=int,
+        default=2,
+        help='Number of jobs touching the same account to run at once')
+    parser.add_argument(
+        '--api-rate-limit',
+        action='append',
+        type=rate_limit,
+        default=[],
+        help='Requests per second allowed for [[ACCOUNT/]REGION/]SERVICE '
+             'across all jobs, e.g. rds=5 or prod/ap-southeast-2/kms=2')
+    parser.add_argument(
+        '--trace-file',
+        help='File to write a JSON trace of every job\'s stage timings and '
+             'API calls to')
+    parser.add_argument(
+        '--metrics-file',
+        help='File to write the metrics of every job to in Prometheus text '
+             'format')
+    parser.add_argument(
+        '--report',
+        help='File to write the JSON summary report to')
+    parser.add_argument(
+        '--wait-timeout',
+        type=int,
+        help='Seconds any single wait for AWS may take before a job fails, '
+             'defaults to 86400')
+    parser.add_argument(
+        '--log-level',
+        default='warning',
+        help='Log level')
+    return parser.parse_args()
+
+
+def load_manifest(path):
+    # a manifest is either a list of jobs, or a dict of jobs plus defaults
+    # every job inherits. Jobs take the same options as rds_backup.py
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('PyYAML is required for YAML manifests.')
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for idx, job in enumerate(manifest['jobs']):
+        job = {**defaults, **job}
+        job.setdefault('name', f'job-{idx}')
+        jobs.append(job)
+    return jobs
+
+
+def get_job_accounts(args):
+    return sorted(set([args.source_account] + args.dest_account))
+
+
+# options that apply to every job in the process, so can't be set per job
+PROCESS_OPTIONS = ['api_rate_limit', 'wait_timeout', 'trace_file',
+                   'metrics_file']
+
+
+def check_job_options(args, scope):
+    for option in PROCESS_OPTIONS:
+        if getattr(args, option) not in (None, []):
+            raise ValueError(f"Set --{option.replace('_', '-')} for {scope}, "
+                             f"not per job")
+
+
+def start_job(name, on_start, graph):
+    # label the job's metrics so jobs running the same steps stay apart
+    graph.job = name
+    if on_start is not None:
+        on_start(graph)
+
+
+def run_job(job, account_limits, limits_lock, account_concurrency,
+            on_start=None):
+    report = {
+        'name': job['name'],
+        'status': 'failed',
+        'seconds': 0,
+        'error': None
+    }
+    start = time.monotonic()
+    options = {k: v for k, v in job.items() if k != 'name'}
+    try:
+        try:
+            args = setup_args(job_to_argv(options))
+        except SystemExit:
+            raise ValueError('Invalid job options')
+        check_job_options(args, 'the whole batch')
+
+        # take account slots in a fixed order so jobs sharing accounts can't
+        # deadlock each other
+        accounts = get_job_accounts(args)
+        with limits_lock:
+            semaphores = [account_limits.setdefault(
+                a, threading.BoundedSemaphore(account_concurrency))
+                for a in accounts]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        try:
+            logging.warning(f'Starting job {job["name"]}')
+            start = time.monotonic()
+            run(args, on_start=partial(start_job, job['name'], on_start))
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+        report['status'] = 'succeeded'
+    except Exception as e:
+        logging.error(f'Job {job["name"]} failed: {e}')
+        report['error'] = str(e)
+    report['seconds'] = round(time.monotonic() - start, 1)
+    return report
+
+
+def main():
+    args = setup_batch_args()
+    iam_init()
+
+    # setup logging
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+    configure_rate_limits(args.api_rate_limit)
+    waiter.configure(timeout=args.wait_timeout)
+
+    jobs = load_manifest(args.manifest)
+    account_limits = {}
+    limits_lock = threading.Lock()
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            reports = list(executor.map(
+                lambda job: run_job(job, account_limits, limits_lock,
+                                    args.account_concurrency), jobs))
+    finally:
+        if args.trace_file:
+            metrics.write_trace(args.trace_file)
+        if args.metrics_file:
+            metrics.write_prometheus_metrics(args.metrics_file)
+
+    summary = {
+        'seconds': round(time.monotonic() - start, 1),
+        'succeeded': len([r for r in reports if r['status'] == 'succeeded']),
+        'failed': len([r for r in reports if r['status'] == 'failed']),
+        'jobs': reports,
+        'client_cache': get_cache_stats(),
+        'throttled_requests': get_throttle_counts()
+    }
+    for report in reports:
+        logging.warning(f'{report["name"]}: {report["status"]} in '
+                        f'{report["seconds"]}s' +
+                        (f' ({report["error"]})' if report['error'] else ''))
+    logging.warning(f'{summary["succeeded"]} succeeded, {summary["failed"]} '
+                    f'failed in {summary["seconds"]}s')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if summary['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
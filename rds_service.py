@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import os
+import hmac
+import json
+import uuid
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from concurrent.futures import ThreadPoolExecutor
+from utils import iam, metrics, waiter
+from utils.iam import iam_init, get_client, get_cache_stats
+from utils.args import setup_args, job_to_argv, rate_limit
+from utils.ratelimit import configure_rate_limits, get_throttle_counts
+from rds_batch import run_job, check_job_options
+
+# clients built for every account and region when the service starts, so the
+# first job doesn't pay for them
+WARM_SERVICES = ['rds', 'kms', 'ssm', 'autoscaling']
+
+# only the owner can reach the default socket, so it needs no token
+DEFAULT_SOCKET = os.path.expanduser('~/.cache/rds_restore/service.sock')
+
+# anyone who can reach a TCP port can submit a restore, which replaces the
+# destination DB, so TCP requests must carry this token
+TOKEN_VARIABLE = 'RDS_RESTORE_SERVICE_TOKEN'
+
+# finished jobs, and their metrics, kept for GET /jobs and /metrics
+FINISHED_JOB_LIMIT = 100
+
+jobs = {}
+graphs = {}
+jobs_lock = threading.Lock()
+account_limits = {}
+limits_lock = threading.Lock()
+executor = None
+account_concurrency = None
+token = None
+
+
+def setup_service_args():
+    parser = argparse.ArgumentParser(
+        description='Run restores submitted over a local HTTP API, keeping '
+                    'credentials and clients warm between jobs')
+    parser.add_argument(
+        '--socket',
+        default=DEFAULT_SOCKET,
+        help='Unix socket to listen on, only its owner can connect')
+    parser.add_argument(
+        '--port',
+        type=int,
+        help=f'TCP port to listen on instead of the socket. Requests must '
+             f'send the token in {TOKEN_VARIABLE} as a bearer token')
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='Address to listen on with --port')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of restore jobs to run at once')
+    parser.add_argument(
+        '--account-concurrency',
+        type=int,
+        default=2,
+        help='Number of jobs touching the same account to run at once')
+    parser.add_argument(
+        '--warm-region',
+        action='append',
+        default=[],
+        help='Region to build clients for at startup, defaults to '
+             'ap-southeast-2')
+    parser.add_argument(
+        '--refresh-interval',
+        type=int,
+        default=300,
+        help='Seconds between refreshing credentials and clients for every '
+             'account')
+    parser.add_argument(
+        '--api-rate-limit',
+        action='append',
+        type=rate_limit,
+        default=[],
+        help='Requests per second allowed for [[ACCOUNT/]REGION/]SERVICE '
+             'across all jobs, e.g. rds=5 or prod/ap-southeast-2/kms=2')
+    parser.add_argument(
+        '--wait-timeout',
+        type=int,
+        help='Seconds any single wait for AWS may take before a job fails, '
+             'defaults to 86400')
+    parser.add_argument(
+        '--trace-file',
+        help='File to write a JSON trace of the kept jobs\' stage timings '
+             'and API calls to on shutdown')
+    parser.add_argument(
+        '--metrics-file',
+        help='File to write the kept jobs\' metrics to in Prometheus text '
+             'format on shutdown')
+    parser.add_argument(
+        '--log-level',
+        default='warning',
+        help='Log level')
+    return parser.parse_args()
+
+
+def warm_clients(regions):
+    # credentials close to expiry are refreshed by get_client
+    for account in sorted(iam.accounts):
+        for region in regions:
+            for service in WARM_SERVICES:
+                try:
+                    get_client(account, service, region)
+                except Exception as e:
+                    logging.error(f'Unable to warm {service} client for '
+                                  f'{account} {region}: {e}')
+
+
+def refresh_clients(regions, interval, stop):
+    while not stop.wait(interval):
+        warm_clients(regions)
+
+
+def get_progress(job_id):
+    graph = graphs.get(job_id)
+    if graph is None:
+        return None
+    states = dict(graph.states)
+    progress = {
+        'steps': len(graph.steps),
+        'done': len([s for s in states.values() if s == 'done']),
+        'running': sorted(n for n, s in states.items() if s == 'running'),
+        'remaining_seconds': None
+    }
+    if graph.estimates and states:
+        progress['remaining_seconds'] = int(max(
+            [end for _, end in graph.schedule().values()], default=0))
+    return progress
+
+
+def get_job(job_id):
+    with jobs_lock:
+        if job_id not in jobs:
+            return None
+        job = dict(jobs[job_id])
+    job['progress'] = get_progress(job_id)
+    return job
+
+
+def run_service_job(job_id, job):
+    def on_start(graph):
+        graph.job = job_id
+        with jobs_lock:
+            graphs[job_id] = graph
+            jobs[job_id]['status'] = 'running'
+
+    report = run_job(job, account_limits, limits_lock, account_concurrency,
+                     on_start)
+    with jobs_lock:
+        jobs[job_id].update({
+            'status': report['status'],
+            'seconds': report['seconds'],
+            'error': report['error']
+        })
+        finished = [i for i, j in jobs.items()
+                    if j['status'] in ('succeeded', 'failed')]
+        # jobs are kept in submission order, so the oldest go first
+        for old_id in finished[:-FINISHED_JOB_LIMIT]:
+            del jobs[old_id]
+            graphs.pop(old_id, None)
+            metrics.drop_spans(old_id)
+
+
+def submit_job(job):
+    options = {k: v for k, v in job.items() if k != 'name'}
+    # reject bad options now rather than once the job is picked up
+    try:
+        args = setup_args(job_to_argv(options))
+    except SystemExit:
+        raise ValueError('Invalid job options')
+    check_job_options(args, 'the service')
+
+    job_id = uuid.uuid4().hex[:12]
+    job.setdefault('name', job_id)
+    with jobs_lock:
+        jobs[job_id] = {
+            'id': job_id,
+            'name': job['name'],
+            'status': 'queued',
+            'submitted': datetime.now(tz=timezone.utc).isoformat(),
+            'seconds': None,
+            'error': None
+        }
+    logging.warning(f'Queued job {job["name"]} as {job_id}')
+    executor.submit(run_service_job, job_id, job)
+    return job_id
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET /health, /jobs, /jobs/<id> and /metrics, POST /jobs with a job in
+    # the same format as an rds_batch.py manifest entry
+
+    def send_body(self, code, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body, indent=2, default=str)
+        body = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorised(self):
+        # unix socket peers are already limited to the socket's owner
+        if token is None:
+            return True
+        header = self.headers.get('Authorization', '')
+        if hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return True
+        self.send_body(401, {'error': 'Missing or invalid token'})
+        return False
+
+    def do_GET(self):
+        if not self.authorised():
+            return
+        if self.path == '/health':
+            self.send_body(200, {
+                'status': 'ok',
+                'accounts': len(iam.accounts),
+                'client_cache': get_cache_stats(),
+                'throttled_requests': get_throttle_counts()
+            })
+        elif self.path == '/jobs':
+            with jobs_lock:
+                job_ids = list(jobs)
+            self.send_body(200, [get_job(job_id) for job_id in job_ids])
+        elif self.path.startswith('/jobs/'):
+            job = get_job(self.path[len('/jobs/'):])
+            if job is None:
+                self.send_body(404, {'error': 'Job not found'})
+            else:
+                self.send_body(200, job)
+        elif self.path == '/metrics':
+            self.send_body(200, metrics.get_prometheus_metrics(),
+                           'text/plain; version=0.0.4')
+        else:
+            self.send_body(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self.authorised():
+            return
+        if self.path != '/jobs':
+            self.send_body(404, {'error': 'Not found'})
+            return
+        # browsers send form and text/plain posts cross site without asking
+        # first, so anything but JSON is refused
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip().lower() != 'application/json':
+            self.send_body(415, {'error': 'Jobs must be application/json'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length))
+            if not isinstance(job, dict):
+                raise ValueError('A job must be a JSON object')
+            job_id = submit_job(job)
+        except ValueError as e:
+            self.send_body(400, {'error': str(e)})
+            return
+        self.send_body(202, get_job(job_id))
+
+    def log_message(self, format, *args):
+        # unix socket peers have no address to log
+        logging.info(f'{self.command} {self.path}: ' + format % args)
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    global executor, account_concurrency, token
+
+    args = setup_service_args()
+    iam_init()
+
+    # setup logging
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+    configure_rate_limits(args.api_rate_limit)
+    waiter.configure(timeout=args.wait_timeout)
+
+    regions = args.warm_region or ['ap-southeast-2']
+    warm_clients(regions)
+    stop = threading.Event()
+    threading.Thread(target=refresh_clients,
+                     args=(regions, args.refresh_interval, stop),
+                     daemon=True).start()
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    account_concurrency = args.account_concurrency
+    if args.port is not None:
+        token = os.environ.get(TOKEN_VARIABLE)
+        if not token:
+            raise SystemExit(f'Set {TOKEN_VARIABLE} to listen on a TCP port')
+        server = ThreadingHTTPServer((args.host, args.port), Handler)
+        logging.warning(f'Listening on {args.host}:{args.port}')
+    else:
+        directory = os.path.dirname(args.socket)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        # created 0600 rather than changed after, so no one else can
+        # connect in between
+        umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(args.socket, Handler)
+        finally:
+            os.umask(umask)
+        logging.warning(f'Listening on {args.socket}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        executor.shutdown(wait=True)
+        if args.trace_file:
+            metrics.write_trace(args.trace_file)
+        if args.metrics_file:
+            metrics.write_prometheus_metrics(args.metrics_file)
+
+
+if __name__ == '__main__':
+    main()
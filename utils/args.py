@@ -1,7 +1,41 @@
 import argparse
+from datetime import datetime, timezone
+from utils.ratelimit import parse_rate_limit
+
+
+def parse_restore_time(value):
+    # timestamps without a timezone are taken as UTC
+    try:
+        restore_time = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'--restore-time {value} should be an ISO 8601 '
+                         'timestamp, e.g. 2024-05-01T03:00:00+00:00')
+    if restore_time.tzinfo is None:
+        restore_time = restore_time.replace(tzinfo=timezone.utc)
+    return restore_time
+
+
+def rate_limit(value):
+    # checked as the arguments are parsed so argparse reports a bad spec
+    try:
+        parse_rate_limit(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
 
 
 def validate_args(args):
+    for tag in args.tag:
+        if '=' not in tag:
+            raise ValueError(f'Tag {tag} should be KEY=VALUE')
+    if args.retain_snapshots is not None and args.retain_snapshots < 1:
+        raise ValueError('--retain-snapshots must be at least 1')
+    for option in ['dest_instance', 'dest_snapshot_name']:
+        if len(getattr(args, option)) != len(args.dest_account):
+            raise ValueError(f"Destination accounts and {option} don't "
+                             'match')
+    if len(args.dest_region) not in (1, len(args.dest_account)):
+        raise ValueError("Destination accounts and regions don't match")
     if len(args.pre_restore_ssm_command) != \
             len(args.pre_restore_ssm_instance_names):
         raise ValueError("Pre-restore SSM commands and instances don't"
@@ -10,19 +44,98 @@ def validate_args(args):
             len(args.post_restore_ssm_instance_names):
         raise ValueError("Post-restore SSM commands and instances don't"
                          'match')
+    if len(args.pre_restore_asg_suspend_action) != \
+            len(args.pre_restore_asg_name):
+        raise ValueError("Pre-restore ASG actions and names don't match")
+    if len(args.post_restore_asg_resume_action) != \
+            len(args.post_restore_asg_name):
+        raise ValueError("Post-restore ASG actions and names don't match")
+    if args.clone and args.source_cluster is None:
+        raise ValueError('--clone needs a --source-cluster')
+    if args.source_cluster is not None:
+        for option in ['swap', 'max_snapshot_age', 'retain_snapshots', 'iops',
+                       'storage_throughput', 'restore_time', 'warm',
+                       'boost_instance_type', 'boost_storage_type',
+                       'boost_iops', 'boost_storage_throughput']:
+            if getattr(args, option) not in (None, False):
+                raise ValueError(f"--{option.replace('_', '-')} isn't "
+                                 'supported for clusters')
+    if not args.warm and (args.warm_ssm_instance_name is not None or
+                          args.warm_workers is not None):
+        raise ValueError('--warm-ssm-instance-name and --warm-workers need '
+                         '--warm')
+    if args.warm_workers is not None and args.warm_workers < 1:
+        raise ValueError('--warm-workers must be at least 1')
+    boost_storage_type = args.boost_storage_type or args.storage_type
+    if args.boost_iops is not None and boost_storage_type == 'gp2':
+        raise ValueError("--boost-iops can't be used with gp2 storage")
+    if boost_storage_type in ('io1', 'io2') and args.boost_iops is None \
+            and args.iops is None:
+        raise ValueError(f'{boost_storage_type} storage needs --iops, or '
+                         '--boost-iops when boosting')
+    if args.boost_storage_throughput is not None and \
+            boost_storage_type != 'gp3':
+        raise ValueError('--boost-storage-throughput needs gp3 storage')
+    # RDS keeps the boosted values when the downgrade leaves them out, on
+    # storage types that have them
+    if args.boost_iops is not None and args.iops is None and \
+            args.storage_type in ('gp3', 'io1', 'io2'):
+        raise ValueError(f'--boost-iops needs --iops to downgrade '
+                         f'{args.storage_type} storage to')
+    if args.boost_storage_throughput is not None and \
+            args.storage_throughput is None and args.storage_type == 'gp3':
+        raise ValueError('--boost-storage-throughput needs '
+                         '--storage-throughput to downgrade gp3 storage to')
+    if args.restore_time is not None:
+        parse_restore_time(args.restore_time)
+        if args.no_point_in_time:
+            raise ValueError("--restore-time can't be used with "
+                             '--no-point-in-time')
+        if any(account != args.source_account
+               for account in args.dest_account):
+            raise ValueError('--restore-time needs every destination in the '
+                             'source account')
+    for hook in ['pre', 'post']:
+        stages = getattr(args, f'{hook}_restore_ssm_stage')
+        commands = getattr(args, f'{hook}_restore_ssm_command')
+        if len(stages) and len(stages) != len(commands):
+            raise ValueError(f"{hook.capitalize()}-restore SSM commands and "
+                             "stages don't match")
 
 
-def setup_args():
+def job_to_argv(job):
+    # turns a manifest job, keyed by option name, into command line arguments
+    argv = []
+    for key, value in job.items():
+        option = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(option)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            for v in value:
+                argv.extend([option, str(v)])
+        else:
+            argv.extend([option, str(value)])
+    return argv
+
+
+def setup_args(argv=None):
     parser = argparse.ArgumentParser()
     source = parser.add_argument_group('source')
     source.add_argument(
         '--source-account',
         help='Account with the source DB',
         required=True)
-    source.add_argument(
+    source_db = source.add_mutually_exclusive_group(required=True)
+    source_db.add_argument(
         '--source-instance',
-        required=True,
         help='Source RDS instance name')
+    source_db.add_argument(
+        '--source-cluster',
+        help='Source Aurora cluster name. Each destination instance names '
+             'the cluster to restore to, with a writer instance named '
+             '<dest-instance>-writer')
     source.add_argument(
         '--source-snapshot-name',
         required=True,
@@ -31,11 +144,41 @@ def setup_args():
         '--source-region',
         default='ap-southeast-2',
         help='AWS region for source snapshot')
+    source.add_argument(
+        '--retain-snapshots',
+        type=int,
+        help='Give each run\'s source and destination snapshots a timestamp '
+             'suffix and keep this many of each, so later copies are '
+             'incremental')
+    source.add_argument(
+        '--max-snapshot-age',
+        type=int,
+        help='Use the newest available snapshot of the source DB if it was '
+             'taken within this many minutes instead of taking a new one')
+    source.add_argument(
+        '--restore-time',
+        help='Restore destinations in the source account to this point in '
+             'time from the source\'s automated backups, as an ISO 8601 '
+             'timestamp. Without it they are restored to the latest '
+             'restorable time')
+    source.add_argument(
+        '--no-point-in-time',
+        action='store_true',
+        help='Restore destinations in the source account from a new snapshot '
+             'rather than from the source\'s automated backups')
+    source.add_argument(
+        '--clone',
+        action='store_true',
+        help='Clone the source cluster to destinations in the same region '
+             'instead of snapshotting and copying it, sharing it through RAM '
+             'with other accounts')
 
     dest = parser.add_argument_group('destination')
     dest.add_argument(
         '--dest-account',
-        help='Account with the destination DB',
+        action='append',
+        help='Account with the destination DB, repeat to restore to several '
+             'destinations in parallel',
         required=True)
     dest.add_argument(
         '--dest-kms-key',
@@ -47,18 +190,23 @@ def setup_args():
 
     dest.add_argument(
         '--dest-instance',
+        action='append',
         required=True,
-        help='Destination RDS instance name')
+        help='Destination RDS instance name, once per destination account')
 
     dest.add_argument(
         '--dest-snapshot-name',
+        action='append',
         required=True,
-        help='Name of destination snapshot when copying source')
+        help='Name of destination snapshot when copying source, once per '
+             'destination account')
 
     dest.add_argument(
         '--dest-region',
-        default='ap-southeast-2',
-        help='AWS region for destination snapshot')
+        action='append',
+        default=[],
+        help='AWS region for destination snapshot, once or once per '
+             'destination account (default ap-southeast-2)')
     dest.add_argument(
         '--multi-az',
         action='store_true',
@@ -71,6 +219,59 @@ def setup_args():
         '--storage-type',
         default='gp2',
         help='Specify storage type for destination RDS instance')
+    dest.add_argument(
+        '--iops',
+        type=int,
+        help='Provisioned IOPS for destination RDS instance storage')
+    dest.add_argument(
+        '--storage-throughput',
+        type=int,
+        help='Storage throughput in MiB/s for gp3 destination storage')
+    dest.add_argument(
+        '--tag',
+        action='append',
+        default=[],
+        help='KEY=VALUE tag to apply to the destination RDS instance')
+    dest.add_argument(
+        '--boost-instance-type',
+        help='Instance type to restore onto, e.g. a larger class for faster '
+             'restores and warm-ups. The DB is resized to --instance-type '
+             'once restored, before it takes traffic')
+    dest.add_argument(
+        '--boost-storage-type',
+        help='Storage type to restore onto, e.g. io1 or gp3, before the DB '
+             'is changed to --storage-type')
+    dest.add_argument(
+        '--boost-iops',
+        type=int,
+        help='Provisioned IOPS to restore with before the DB is changed to '
+             '--iops')
+    dest.add_argument(
+        '--boost-storage-throughput',
+        type=int,
+        help='Storage throughput in MiB/s to restore with before the DB is '
+             'changed to --storage-throughput')
+    dest.add_argument(
+        '--warm',
+        action='store_true',
+        help='Read every block of the restored PostgreSQL DB after it '
+             'reboots, so its storage is loaded from S3 before the '
+             'post-restore hooks run. The DB is tagged rds-restore-ready '
+             'once warmed. Connects to the DB directly with psycopg2 unless '
+             '--warm-ssm-instance-name is given')
+    dest.add_argument(
+        '--warm-workers',
+        type=int,
+        help='Number of relations to read at once when warming, default 8')
+    dest.add_argument(
+        '--warm-ssm-instance-name',
+        help='Name tag of instances, e.g. a bastion, to warm the DB from '
+             'through SSM instead of connecting from here')
+    dest.add_argument(
+        '--swap',
+        action='store_true',
+        help='Restore to a temporary instance while the existing destination '
+             'DB keeps serving, then swap it in by renaming both')
 
     ssm = parser.add_argument_group('SSM')
     ssm.add_argument(
@@ -94,11 +295,66 @@ def setup_args():
         '--ssm-parameter-group',
         default='lapis.DB_PARAMETER_GROUP',
         help='Name of SSM parameter containing the parameter group for the DB')
+    ssm.add_argument(
+        '--ssm-cluster-parameter-group',
+        help='Name of SSM parameter containing the cluster parameter group, '
+             'when restoring a cluster')
+    ssm.add_argument(
+        '--ssm-cluster-instance-parameter-group',
+        help='Name of SSM parameter containing the DB parameter group for '
+             'the writer instance, when restoring a cluster. Without it the '
+             'engine\'s default group is used')
+    ssm.add_argument(
+        '--ssm-max-concurrency',
+        help='Number or percentage of instances to run restore commands on '
+             'at once, e.g. 50 or 10%%')
+    ssm.add_argument(
+        '--ssm-max-errors',
+        help='Number or percentage of instances restore commands may fail '
+             'on before the command, and the restore, fails')
 
     parser.add_argument(
         '--log-level',
         default='warning',
         help='Log level')
+    parser.add_argument(
+        '--api-rate-limit',
+        action='append',
+        type=rate_limit,
+        default=[],
+        help='Requests per second allowed for [[ACCOUNT/]REGION/]SERVICE, '
+             'e.g. rds=5 or prod/ap-southeast-2/kms=2')
+    parser.add_argument(
+        '--wait-timeout',
+        type=int,
+        help='Seconds any single wait for AWS may take before the restore '
+             'fails, defaults to 86400')
+    parser.add_argument(
+        '--trace-file',
+        help='File to write a JSON trace of stage timings and API calls to')
+    parser.add_argument(
+        '--metrics-file',
+        help='File to write run metrics to in Prometheus text format')
+    parser.add_argument(
+        '--journal-file',
+        default='rds_backup_journal.json',
+        help='File recording the completed steps of each run')
+    parser.add_argument(
+        '--history-file',
+        default='rds_backup_history.json',
+        help='File recording how long each step of earlier runs took, used '
+             'to estimate durations')
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Print the steps of the run with their estimated start times '
+             'and durations, then exit without changing anything')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip steps the journal records as completed for the same '
+             'source and destinations, after checking their resources '
+             'still exist')
 
     pre = parser.add_argument_group('Pre Restore Commands')
     pre.add_argument(
@@ -111,6 +367,14 @@ def setup_args():
         action='append',
         default=[],
         help='Name tag of instances to run pre-restore commands on')
+    pre.add_argument(
+        '--pre-restore-ssm-stage',
+        action='append',
+        type=int,
+        default=[],
+        help='Stage of each pre-restore command. Commands in the same stage '
+             'run at the same time, stages run in ascending order. Without '
+             'stages commands run one after another')
     pre.add_argument(
         '--pre-restore-asg-suspend-action',
         action='append',
@@ -133,6 +397,13 @@ def setup_args():
         action='append',
         default=[],
         help='Name tag of instances to run post-restore commands on')
+    post.add_argument(
+        '--post-restore-ssm-stage',
+        action='append',
+        type=int,
+        default=[],
+        help='Stage of each post-restore command, as for '
+             '--pre-restore-ssm-stage')
     pre.add_argument(
         '--post-restore-asg-resume-action',
         action='append',
@@ -144,10 +415,33 @@ def setup_args():
         default=[],
         help='Name of ASG to run resume actions on')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if args.multi_az is None:
         args.multi_az = False
     if args.public is None:
         args.public = False
+    if len(args.dest_region) == 0:
+        args.dest_region = ['ap-southeast-2']
     validate_args(args)
+    args.tags = dict(tag.split('=', 1) for tag in args.tag)
+    if args.restore_time is not None:
+        args.restore_time = parse_restore_time(args.restore_time)
+    if args.warm_workers is None:
+        args.warm_workers = 8
+    if len(args.dest_region) == 1:
+        args.dest_region = args.dest_region * len(args.dest_account)
+    args.destinations = [{
+        'name': f'{account}/{region}/{instance}',
+        'account': account,
+        'region': region,
+        'instance': instance,
+        'snapshot_name': snapshot_name
+    } for account, region, instance, snapshot_name in zip(
+        args.dest_account, args.dest_region, args.dest_instance,
+        args.dest_snapshot_name)]
+    # estimated step durations, filled in from the history when a run starts
+    args.estimates = {}
+    # regions the source can be restored to a point in time in, filled in
+    # when a run starts
+    args.automated_backups = {}
     return args
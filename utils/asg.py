@@ -1,21 +1,53 @@
-from utils.iam import get_client, get_account_id_from_name
+from concurrent.futures import ThreadPoolExecutor
+from utils.iam import get_client
 
+# ASG API calls each take one group, so batches are sent this many at a time
+ASG_WORKERS = 10
 
-def suspend_asg_action(account, region, asg_action, asg_name):
+
+def get_scaling_processes(actions):
+    # None means every process
+    processes = set()
+    for action in actions:
+        if action.lower() == 'all':
+            return None
+        processes.add(action)
+    return sorted(processes)
+
+
+def batch_asg_actions(account, region, method, actions):
+    # actions are (action, asg name) pairs. Actions on the same group are
+    # merged into one call and the groups are updated concurrently
+    groups = {}
+    for action, asg_name in actions:
+        groups.setdefault(asg_name, []).append(action)
+    if not len(groups):
+        return
     client = get_client(account, 'autoscaling', region)
-    args = {'AutoScalingGroupName': asg_name}
-    if asg_action.lower() != 'all':
-        if not isinstance(asg_action, list):
-            asg_action = [asg_action]
-            args['ScalingProcesses'] = asg_action
-    client.suspend_processes(**args)
+
+    def apply(asg_name):
+        args = {'AutoScalingGroupName': asg_name}
+        processes = get_scaling_processes(groups[asg_name])
+        if processes is not None:
+            args['ScalingProcesses'] = processes
+        getattr(client, method)(**args)
+
+    with ThreadPoolExecutor(
+            max_workers=min(ASG_WORKERS, len(groups))) as executor:
+        list(executor.map(apply, sorted(groups)))
+
+
+def suspend_asg_actions(account, region, actions):
+    batch_asg_actions(account, region, 'suspend_processes', actions)
+
+
+def resume_asg_actions(account, region, actions):
+    batch_asg_actions(account, region, 'resume_processes', actions)
+
+
+def suspend_asg_action(account, region, asg_action, asg_name):
+    suspend_asg_actions(account, region, [(asg_action, asg_name)])
 
 
 def resume_asg_action(account, region, asg_action, asg_name):
-    client = get_client(account, 'autoscaling', region)
-    args = {'AutoScalingGroupName': asg_name}
-    if asg_action.lower() != 'all':
-        if not isinstance(asg_action, list):
-            asg_action = [asg_action]
-            args['ScalingProcesses'] = asg_action
-    client.resume_processes(**args)
+    resume_asg_actions(account, region, [(asg_action, asg_name)])
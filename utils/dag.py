@@ -0,0 +1,222 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils import metrics
+
+
+class StepGraph:
+    # Runs named steps concurrently as soon as the steps they depend on have
+    # finished. Each step function is called with the dict of results from
+    # the steps that have completed so far.
+    #
+    # If a step fails no new steps are started, but steps added with
+    # always=True still run once everything they depend on has settled so
+    # they can clean up (e.g. unsharing a KMS key).
+    #
+    # Steps added with a verify function are checkpointed to the journal.
+    # When resuming, a checkpointed step is skipped if the journal has it,
+    # verify confirms the resource it produced is still there, and nothing
+    # upstream of it had to be redone.
+    #
+    # Given estimated durations for its steps, the graph can predict when
+    # each step will start and finish, before or during a run.
+
+    def __init__(self, max_workers=None, journal=None, estimates=None):
+        self.max_workers = max_workers
+        self.journal = journal
+        self.estimates = estimates or {}
+        self.invalidated = set()
+        self.steps = {}
+        self.results = {}
+        self.states = {}
+        self.timings = {}
+        self.started = {}
+        self.outcomes = {}
+        self.critical_path = []
+        # labels the metrics of this graph's steps, e.g. with a service job
+        self.job = None
+        self.lock = threading.Lock()
+
+    def add(self, name, fn, deps=(), always=False, verify=None):
+        if name in self.steps:
+            raise ValueError(f'Step {name} already defined.')
+        self.steps[name] = {
+            'fn': fn,
+            'deps': list(deps),
+            'always': always,
+            'verify': verify
+        }
+
+    def validate(self):
+        for name, step in self.steps.items():
+            for dep in step['deps']:
+                if dep not in self.steps:
+                    raise ValueError(f'Step {name} depends on unknown step '
+                                     f'{dep}.')
+        visiting = set()
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle through step {name}.')
+            visiting.add(name)
+            for dep in self.steps[name]['deps']:
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def ready(self, name, failed):
+        step = self.steps[name]
+        deps = [self.states[d] for d in step['deps']]
+        if all(state == 'done' for state in deps):
+            return True
+        if failed and step['always']:
+            return all(state in ('done', 'failed', 'skipped')
+                       for state in deps)
+        return False
+
+    def resume_step(self, name):
+        step = self.steps[name]
+        if self.journal is None or step['verify'] is None:
+            return False, None
+        with self.lock:
+            if any(dep in self.invalidated for dep in step['deps']):
+                return False, None
+        entry = self.journal.get(name)
+        if entry is None or not step['verify'](entry['result']):
+            return False, None
+        return True, entry['result']
+
+    def run_step(self, name):
+        step = self.steps[name]
+        start = time.monotonic()
+        self.started[name] = start
+        span = metrics.start_span(name, self.job)
+        status = 'failed'
+        try:
+            resumed, result = self.resume_step(name)
+            if resumed:
+                logging.warning(f'Step {name} already completed, skipping')
+                status = 'resumed'
+                return result
+
+            with self.lock:
+                results = dict(self.results)
+                # anything downstream of a step that had to run again has to
+                # run again too
+                if step['verify'] is not None or \
+                        any(dep in self.invalidated for dep in step['deps']):
+                    self.invalidated.add(name)
+            result = step['fn'](results)
+            if self.journal is not None and step['verify'] is not None:
+                self.journal.record(name, result)
+            status = 'done'
+            return result
+        finally:
+            self.timings[name] = (start, time.monotonic())
+            self.outcomes[name] = status
+            metrics.end_span(span, status)
+
+    def run(self):
+        self.validate()
+        self.states = {name: 'pending' for name in self.steps}
+        error = None
+        running = {}
+        start = time.monotonic()
+
+        max_workers = self.max_workers or max(len(self.steps), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                failed = error is not None
+                if failed:
+                    for name, state in self.states.items():
+                        if state == 'pending' and \
+                                not self.steps[name]['always']:
+                            self.states[name] = 'skipped'
+
+                for name, state in self.states.items():
+                    if state == 'pending' and self.ready(name, failed):
+                        self.states[name] = 'running'
+                        logging.info(f'Starting step {name}')
+                        running[executor.submit(self.run_step, name)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.states[name] = 'failed'
+                        logging.error(f'Step {name} failed: {e}')
+                        if error is None:
+                            error = e
+                        continue
+                    with self.lock:
+                        self.results[name] = result
+                    self.states[name] = 'done'
+                    if self.estimates:
+                        remaining = max(
+                            [end for _, end in self.schedule().values()],
+                            default=0)
+                        logging.warning(f'Step {name} finished, about '
+                                        f'{int(remaining)}s remaining')
+
+        self.critical_path = self.find_critical_path()
+        logging.warning(
+            f'Finished in {int(time.monotonic() - start)}s, critical path: ' +
+            ' -> '.join(f'{name} ({int(end - begin)}s)'
+                        for name, begin, end in self.critical_path))
+        if error is not None:
+            raise error
+        return self.results
+
+    def find_critical_path(self):
+        # walk back from the step that finished last, each time following the
+        # dependency that finished last, as that's what held the step up
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = []
+        while name is not None:
+            path.append((name,) + self.timings[name])
+            deps = [d for d in self.steps[name]['deps'] if d in self.timings]
+            name = max(deps, key=lambda d: self.timings[d][1]) \
+                if deps else None
+        return list(reversed(path))
+
+    def schedule(self):
+        # predicted (start, end) of each step in seconds from now, from the
+        # estimated durations and what has already run. Steps without an
+        # estimate are assumed to be instant
+        now = time.monotonic()
+        schedule = {}
+
+        def visit(name):
+            if name in schedule:
+                return schedule[name][1]
+            state = self.states.get(name, 'pending')
+            duration = self.estimates.get(name) or 0
+            if state in ('done', 'failed', 'skipped'):
+                start = duration = 0
+            elif state == 'running':
+                start = 0
+                duration = max(
+                    duration - (now - self.started.get(name, now)), 0)
+            else:
+                start = max([visit(d) for d in self.steps[name]['deps']],
+                            default=0)
+            schedule[name] = (start, start + duration)
+            return start + duration
+
+        for name in self.steps:
+            visit(name)
+        return schedule
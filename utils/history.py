@@ -0,0 +1,88 @@
+import logging
+import threading
+from statistics import median
+from datetime import datetime, timezone
+from utils.jsonfile import load_json, update_json
+
+# only the most recent runs of each stage are kept, so estimates follow
+# changes in how fast AWS is
+HISTORY_LIMIT = 50
+
+# stages whose duration grows with the size of the database, estimated per
+# GiB of allocated storage rather than in absolute seconds
+STORAGE_BOUND_STAGES = ('create_snapshot', 'copy', 'restore', 'warm',
+                        'downgrade')
+
+# features to match on, from most to least specific. When no earlier run
+# matches every feature the least useful one is dropped. Clones and point in
+# time restores are never estimated from snapshot restores or the other way
+# around
+ESTIMATE_FEATURES = [
+    ('engine', 'instance_class', 'cross_region', 'clone', 'point_in_time'),
+    ('engine', 'cross_region', 'clone', 'point_in_time'),
+    ('cross_region', 'clone', 'point_in_time'),
+    ('clone', 'point_in_time')
+]
+
+
+def get_stage(step):
+    # per destination steps are suffixed with the destination name
+    return step.split(':')[0]
+
+
+class History:
+    # Records how long each stage of earlier runs took, alongside what
+    # drives the duration (allocated storage, engine, instance class, whether
+    # a copy crossed regions and whether a cluster was cloned or an instance
+    # restored to a point in time), and estimates future durations from the
+    # closest matching runs.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stages = load_json(path)
+
+    def record(self, step, seconds, features):
+        with self.lock:
+            records = self.stages.setdefault(get_stage(step), [])
+            records.append({
+                'recorded': datetime.now(tz=timezone.utc).isoformat(),
+                'seconds': round(seconds, 1),
+                'features': features
+            })
+            del records[:-HISTORY_LIMIT]
+
+    def estimate(self, step, features):
+        stage = get_stage(step)
+        with self.lock:
+            records = list(self.stages.get(stage, []))
+        for keys in ESTIMATE_FEATURES:
+            matches = [r for r in records
+                       if all(r['features'].get(k) == features.get(k)
+                              for k in keys)]
+            if not len(matches):
+                continue
+            if stage not in STORAGE_BOUND_STAGES:
+                return median(r['seconds'] for r in matches)
+            rates = [r['seconds'] / r['features']['storage']
+                     for r in matches if r['features'].get('storage')]
+            if len(rates) and features.get('storage'):
+                return median(rates) * features['storage']
+        return None
+
+    def save(self):
+        # pick up records other runs have saved since we loaded
+        def merge(stages):
+            with self.lock:
+                for stage, records in self.stages.items():
+                    known = set(r['recorded'] for r in records)
+                    merged = [r for r in stages.get(stage, [])
+                              if r['recorded'] not in known] + records
+                    merged.sort(key=lambda r: r['recorded'])
+                    stages[stage] = merged[-HISTORY_LIMIT:]
+            return stages
+
+        stages = update_json(self.path, merge)
+        with self.lock:
+            self.stages = stages
+        logging.debug(f'Saved history {self.path}')
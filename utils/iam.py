@@ -1,19 +1,68 @@
 #!/usr/bin/env python3
 
 import boto3
+from botocore.config import Config
 import os
 import pwd
 import json
-from datetime import datetime, timezone
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from utils import metrics, ratelimit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 accounts = {}
 creds = {}
+sessions = {}
+clients = {}
+cache_stats = {
+    'client_hits': 0,
+    'client_misses': 0,
+    'creds_hits': 0,
+    'creds_misses': 0,
+    'creds_disk_hits': 0
+}
+
+# refresh assumed role credentials this long before they expire so a client
+# handed out from the cache never carries credentials that lapse mid-call
+CREDS_REFRESH_MARGIN = timedelta(minutes=10)
+
+# adaptive mode backs off and slows the client down when throttled
+RETRY_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+
+# what a cached entry needs besides its expiry to build a session
+CREDS_KEYS = ('AccessKeyId', 'SecretAccessKey', 'SessionToken')
+
+lock = threading.RLock()
+
+# every boto3 session is built through this, benchmarks swap in a fake backend
+session_factory = boto3.session.Session
+
+# assumed role credentials are shared between processes through this file,
+# so concurrent and back to back runs don't each call STS. Set
+# RDS_RESTORE_CREDS_CACHE to an empty string to turn it off
+creds_cache_path = os.environ.get(
+    'RDS_RESTORE_CREDS_CACHE',
+    os.path.expanduser('~/.cache/rds_restore/credentials.json'))
 
 
 def iam_init():
     load_accounts()
 
 
+def reset_caches():
+    with lock:
+        creds.clear()
+        sessions.clear()
+        clients.clear()
+
+
 def load_accounts():
     global accounts
     with open('aws_accounts.json') as f:
@@ -27,41 +76,165 @@ def get_account_id_from_name(name):
     return account
 
 
+def creds_expiring(credentials):
+    return credentials['Expiration'] - CREDS_REFRESH_MARGIN < \
+        datetime.now(tz=timezone.utc)
+
+
+@contextmanager
+def locked_creds_cache(path):
+    # held while reading, assuming the role and writing back, so concurrent
+    # processes wait for one STS call rather than each making their own
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def load_creds_cache(path):
+    # a cache other users could read or write isn't trusted
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        logging.warning(f'Ignoring credentials cache {path}, it should be '
+                        'owned by this user with permissions 0600')
+        return {}
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except ValueError:
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    # an entry that can't be read is a cache miss, not a failed client build
+    valid = {}
+    for key, credentials in entries.items():
+        try:
+            expiration = datetime.fromisoformat(credentials['Expiration'])
+            keys = [credentials[k] for k in CREDS_KEYS]
+        except (ValueError, KeyError, TypeError):
+            continue
+        if expiration.tzinfo is not None and all(keys):
+            valid[key] = dict(credentials, Expiration=expiration)
+    return valid
+
+
+def save_creds_cache(path, entries):
+    # expired entries are dropped, the file is replaced in one go so readers
+    # never see it half written
+    now = datetime.now(tz=timezone.utc)
+    data = {key: dict(credentials,
+                      Expiration=credentials['Expiration'].isoformat())
+            for key, credentials in entries.items()
+            if credentials['Expiration'] > now}
+    # mkstemp always creates a new file with permissions 0600, so a leftover
+    # temporary file can't hand its permissions on to the cache
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def get_cached_creds(arn, session_name, request):
+    # returns credentials for the role and session from the disk cache,
+    # calling request for new ones when they're missing or close to expiry
+    if not creds_cache_path or fcntl is None:
+        return request()
+    key = f'{arn} {session_name}'
+    with locked_creds_cache(creds_cache_path):
+        entries = load_creds_cache(creds_cache_path)
+        credentials = entries.get(key)
+        if credentials is not None and not creds_expiring(credentials):
+            cache_stats['creds_disk_hits'] += 1
+            return credentials
+        entries[key] = credentials = request()
+        save_creds_cache(creds_cache_path, entries)
+        return credentials
+
+
+def get_session(account):
+    with lock:
+        credentials = assume_role(account)
+        session = sessions.get(account)
+        if session is not None and session[0] is credentials:
+            return session[1]
+
+        # credentials were (re)issued, any clients built from the old session
+        # are stale
+        for key in [k for k in clients if k[0] == account]:
+            del clients[key]
+        session = session_factory(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'])
+        sessions[account] = (credentials, session)
+        return session
+
+
 def get_client(account, service, region='ap-southeast-2'):
-    creds = assume_role(account)
-    client = boto3.client(
-        service_name=service,
-        aws_access_key_id=creds['AccessKeyId'],
-        aws_secret_access_key=creds['SecretAccessKey'],
-        aws_session_token=creds['SessionToken'],
-        region_name=region
-    )
-    return client
+    with lock:
+        session = get_session(account)
+        key = (account, service, region)
+        if key in clients:
+            cache_stats['client_hits'] += 1
+            return clients[key]
+
+        cache_stats['client_misses'] += 1
+        client = session.client(service_name=service, region_name=region,
+                                config=RETRY_CONFIG)
+        ratelimit.instrument_client(client, account, region, service)
+        metrics.instrument_client(client, service)
+        clients[key] = client
+        return client
+
+
+def get_cache_stats():
+    with lock:
+        return dict(cache_stats)
 
 
 def assume_role(account, timeout=28800):
     global creds
 
-    if account in creds:
-        if creds[account]['Expiration'] < datetime.now(tz=timezone.utc):
-            return creds[account]
-
-    arn = None
-    for a, k in accounts.items():
-        if a.startswith(account):
-            arn = k
-            break
-
-    if arn is None:
-        raise ValueError(f'ARN for account {account} not found.')
-
-    client = boto3.client('sts')
-    username = pwd.getpwuid(os.getuid())[0]
-    response = client.assume_role(
-        RoleArn=arn,
-        RoleSessionName=username,
-        DurationSeconds=timeout
-    )
-
-    creds[account] = response['Credentials']
-    return response['Credentials']
+    with lock:
+        if account in creds:
+            if not creds_expiring(creds[account]):
+                cache_stats['creds_hits'] += 1
+                return creds[account]
+
+        cache_stats['creds_misses'] += 1
+        arn = None
+        for a, k in accounts.items():
+            if a.startswith(account):
+                arn = k
+                break
+
+        if arn is None:
+            raise ValueError(f'ARN for account {account} not found.')
+
+        username = pwd.getpwuid(os.getuid())[0]
+
+        def request():
+            client = session_factory().client('sts')
+            response = client.assume_role(
+                RoleArn=arn,
+                RoleSessionName=username,
+                DurationSeconds=timeout
+            )
+            return response['Credentials']
+
+        creds[account] = get_cached_creds(arn, username, request)
+        return creds[account]
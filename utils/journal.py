@@ -0,0 +1,48 @@
+import logging
+import threading
+from datetime import datetime, timezone
+from utils.jsonfile import load_json, update_json
+
+
+class Journal:
+    # Persists the steps of a run that have completed, along with their
+    # results, so a failed run can be resumed without redoing hours of
+    # snapshot and copy work. Runs are keyed so one journal file can hold
+    # several independent restores.
+
+    def __init__(self, path, run_key):
+        self.path = path
+        self.run_key = run_key
+        self.lock = threading.Lock()
+        self.runs = load_json(path)
+        self.steps = self.runs.setdefault(run_key, {}).setdefault('steps', {})
+
+    def reset(self):
+        with self.lock:
+            self.runs[self.run_key] = {
+                'started': datetime.now(tz=timezone.utc).isoformat(),
+                'steps': {}
+            }
+            self.steps = self.runs[self.run_key]['steps']
+            self.save()
+
+    def get(self, step):
+        with self.lock:
+            return self.steps.get(step)
+
+    def record(self, step, result):
+        with self.lock:
+            self.steps[step] = {
+                'finished': datetime.now(tz=timezone.utc).isoformat(),
+                'result': result
+            }
+            self.save()
+
+    def save(self):
+        # pick up runs other journals have saved since we loaded
+        def merge(runs):
+            runs[self.run_key] = self.runs[self.run_key]
+            return runs
+
+        self.runs = update_json(self.path, merge)
+        logging.debug(f'Saved journal {self.path}')
@@ -0,0 +1,67 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# threads in this process take this, other processes the lock file
+lock = threading.Lock()
+
+
+@contextmanager
+def locked_file(path):
+    # held across a read, merge and write so concurrent runs, in this
+    # process or others, don't drop each other's updates
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def load_json(path):
+    # a missing or unreadable file starts afresh rather than failing the run
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.warning(f'Ignoring {path}, it is not valid JSON')
+        return {}
+
+
+def write_json(path, data):
+    # each writer gets its own temporary file next to the target, and the
+    # rename replaces the target in one go so readers never see it half
+    # written
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2, default=str)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def update_json(path, merge):
+    # merge takes what's on disk and returns what to write back
+    with locked_file(path):
+        data = merge(load_json(path))
+        write_json(path, data)
+    return data
@@ -1,21 +1,37 @@
 from utils.iam import get_client, get_account_id_from_name
 import json
+import threading
 from hashlib import md5
 
+keys = {}
+keys_lock = threading.Lock()
+
+
+def describe_key(account, region, key):
+    # key may be a key id, key ARN, alias name or alias ARN
+    with keys_lock:
+        if (account, region, key) in keys:
+            return keys[(account, region, key)]
 
-def get_key_id_from_alias(account, region, key_alias):
     client = get_client(account, 'kms', region)
-    args = {}
-    while True:
-        response = client.list_aliases(**args)
-        for alias in response['Aliases']:
-            if alias['AliasName'] == key_alias:
-                return alias['TargetKeyId']
-        if response['Truncated'] is True:
-            args['Marker'] = response['NextMarker']
-        else:
-            break
-    raise ValueError(f'KMS key alias {key_alias} not found.')
+    try:
+        response = client.describe_key(KeyId=key)
+    except client.exceptions.NotFoundException:
+        raise ValueError(f'KMS key {key} not found in {account} {region}.')
+
+    metadata = {
+        'KeyId': response['KeyMetadata']['KeyId'],
+        'Arn': response['KeyMetadata']['Arn'],
+        'Region': region
+    }
+    with keys_lock:
+        for k in (key, metadata['KeyId'], metadata['Arn']):
+            keys[(account, region, k)] = metadata
+    return metadata
+
+
+def get_key_id_from_alias(account, region, key_alias):
+    return describe_key(account, region, key_alias)['KeyId']
 
 
 def get_temporary_permissions_sid(share_accounts):
@@ -25,10 +41,7 @@ def get_temporary_permissions_sid(share_accounts):
 
 def share_kms_key(account, region, key, share_accounts):
     client = get_client(account, 'kms', region)
-    key_id = key
-
-    if key.startswith('alias/'):
-        key_id = get_key_id_from_alias(account, region, key)
+    key_id = describe_key(account, region, key)['KeyId']
 
     response = client.get_key_policy(KeyId=key_id, PolicyName='default')
     key_policy = json.loads(response['Policy'])
@@ -73,6 +86,10 @@ def share_kms_key(account, region, key, share_accounts):
         new_policy_part_b['Principal']['AWS'].append(
             f'arn:aws:iam::{sa}:root')
 
+    # drop statements left behind by an earlier run so sharing is repeatable
+    key_policy['Statement'] = [
+        statement for statement in key_policy['Statement']
+        if statement.get('Sid') not in (sid, sid + '-b')]
     key_policy['Statement'].append(new_policy_part_a)
     key_policy['Statement'].append(new_policy_part_b)
 
@@ -88,20 +105,15 @@ def share_kms_key(account, region, key, share_accounts):
 
 def unshare_kms_key(account, region, key, share_accounts):
     client = get_client(account, 'kms', region)
-    key_id = key
-
-    if key.startswith('alias/'):
-        key_id = get_key_id_from_alias(account, region, key)
+    key_id = describe_key(account, region, key)['KeyId']
 
     response = client.get_key_policy(KeyId=key_id, PolicyName='default')
     key_policy = json.loads(response['Policy'])
 
     sid = get_temporary_permissions_sid(share_accounts)
-    for idx, statement in enumerate(key_policy['Statement']):
-        if statement['Sid'] == sid:
-            del key_policy['Statement'][idx]
-        elif statement['Sid'] == sid + '-b':
-            del key_policy['Statement'][idx]
+    key_policy['Statement'] = [
+        statement for statement in key_policy['Statement']
+        if statement.get('Sid') not in (sid, sid + '-b')]
     client.put_key_policy(
         KeyId=key_id,
         PolicyName='default',
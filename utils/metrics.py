@@ -0,0 +1,196 @@
+import time
+import json
+import threading
+
+spans = []
+api_calls = {}
+api_attempts = {}
+counters = {}
+lock = threading.Lock()
+local = threading.local()
+
+
+def reset():
+    with lock:
+        spans.clear()
+        api_calls.clear()
+        api_attempts.clear()
+        counters.clear()
+
+
+def start_span(name, job=None):
+    span = {
+        'name': name,
+        'job': job,
+        'start': time.time(),
+        'end': None,
+        'seconds': None,
+        'wait_seconds': None,
+        'waits': [],
+        'status': 'running'
+    }
+    local.span = span
+    with lock:
+        spans.append(span)
+    return span
+
+
+def get_wait_seconds(waits):
+    # waits on worker threads overlap, count the time any of them was
+    # waiting once
+    total = 0
+    waited_until = None
+    for start, end in sorted((w['start'], w['start'] + w['seconds'])
+                             for w in waits):
+        if waited_until is not None:
+            start = max(start, waited_until)
+        if end > start:
+            total += end - start
+            waited_until = end
+    return total
+
+
+def end_span(span, status):
+    span['end'] = time.time()
+    span['seconds'] = round(span['end'] - span['start'], 3)
+    with lock:
+        span['wait_seconds'] = round(get_wait_seconds(span['waits']), 3)
+    span['status'] = status
+    local.span = None
+
+
+def bind_span(fn):
+    # fn will run on a worker thread, charge what it does to the span running
+    # on this one
+    span = getattr(local, 'span', None)
+
+    def run(*args, **kwargs):
+        local.span = span
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.span = None
+    return run
+
+
+def add_wait(wait):
+    # charge time spent in a waiter to the span running on this thread, and
+    # keep how each wait went for the trace
+    span = getattr(local, 'span', None)
+    if span is not None:
+        with lock:
+            span['waits'].append(wait)
+
+
+def drop_spans(job):
+    # a long running process forgets the spans of jobs it no longer reports
+    with lock:
+        spans[:] = [span for span in spans if span['job'] != job]
+
+
+def add_counter(name, value=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def instrument_client(client, service):
+    # after-call fires once per operation, before-send once per attempt
+    def after_call(**kwargs):
+        with lock:
+            api_calls[service] = api_calls.get(service, 0) + 1
+
+    def before_send(**kwargs):
+        with lock:
+            api_attempts[service] = api_attempts.get(service, 0) + 1
+
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('before-send', before_send)
+    return client
+
+
+def summarise_api_calls():
+    return {service: {
+        'calls': api_calls.get(service, 0),
+        'retries': max(api_attempts.get(service, 0) -
+                       api_calls.get(service, 0), 0)
+    } for service in set(api_calls) | set(api_attempts)}
+
+
+def get_api_stats():
+    with lock:
+        return summarise_api_calls()
+
+
+def get_trace():
+    with lock:
+        return {
+            'spans': [dict(span) for span in spans],
+            'api': summarise_api_calls(),
+            'counters': dict(counters)
+        }
+
+
+def write_trace(path):
+    with open(path, 'w') as f:
+        json.dump(get_trace(), f, indent=2)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def get_span_labels(span):
+    labels = f'stage="{escape_label(span["name"])}"'
+    if span['job'] is not None:
+        labels += f',job_id="{escape_label(span["job"])}"'
+    return labels
+
+
+def get_prometheus_metrics():
+    trace = get_trace()
+    lines = [
+        '# HELP rds_restore_stage_duration_seconds Duration of each stage',
+        '# TYPE rds_restore_stage_duration_seconds gauge'
+    ]
+    for span in trace['spans']:
+        if span['seconds'] is None:
+            continue
+        lines.append(f'rds_restore_stage_duration_seconds{{'
+                     f'{get_span_labels(span)},status="{span["status"]}"}} '
+                     f'{span["seconds"]}')
+    lines += [
+        '# HELP rds_restore_stage_wait_seconds Time each stage spent '
+        'waiting on AWS',
+        '# TYPE rds_restore_stage_wait_seconds gauge'
+    ]
+    for span in trace['spans']:
+        if span['seconds'] is None:
+            continue
+        lines.append(f'rds_restore_stage_wait_seconds{{'
+                     f'{get_span_labels(span)}}} {span["wait_seconds"]}')
+    lines += [
+        '# HELP rds_restore_api_calls_total API calls made per service',
+        '# TYPE rds_restore_api_calls_total counter'
+    ]
+    for service, stats in sorted(trace['api'].items()):
+        lines.append(f'rds_restore_api_calls_total{{service="{service}"}} '
+                     f'{stats["calls"]}')
+    lines += [
+        '# HELP rds_restore_api_retries_total API call retries per service',
+        '# TYPE rds_restore_api_retries_total counter'
+    ]
+    for service, stats in sorted(trace['api'].items()):
+        lines.append(f'rds_restore_api_retries_total{{service="{service}"}} '
+                     f'{stats["retries"]}')
+    for name, value in sorted(trace['counters'].items()):
+        lines += [
+            f'# TYPE rds_restore_{name} counter',
+            f'rds_restore_{name} {value}'
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_metrics(path):
+    with open(path, 'w') as f:
+        f.write(get_prometheus_metrics())
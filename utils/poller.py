@@ -0,0 +1,66 @@
+import time
+import threading
+from utils import waiter
+
+# describe filters accept at most 100 values
+FILTER_CHUNK_SIZE = 100
+
+
+class BatchPoller:
+    # Coalesces status lookups for many resources of one kind in one
+    # account/region. Every waiter asks the poller for its identifier; the
+    # first caller after the results go stale refreshes all watched
+    # identifiers with a single filtered describe call and everyone else is
+    # served from that result.
+
+    def __init__(self, describe, max_age=None):
+        self.describe = describe
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.watched = {}
+        self.polled = set()
+        self.results = {}
+        self.refreshed = None
+        self.calls = 0
+
+    def watch(self, identifier):
+        with self.lock:
+            self.watched[identifier] = self.watched.get(identifier, 0) + 1
+
+    def unwatch(self, identifier):
+        with self.lock:
+            self.watched[identifier] -= 1
+            if self.watched[identifier] <= 0:
+                del self.watched[identifier]
+                self.polled.discard(identifier)
+                self.results.pop(identifier, None)
+
+    def stale(self, identifier):
+        if identifier not in self.polled or self.refreshed is None:
+            return True
+        max_age = self.max_age
+        if max_age is None:
+            max_age = waiter.MIN_DELAY
+        return time.monotonic() - self.refreshed >= max_age
+
+    def refresh(self):
+        identifiers = sorted(self.watched)
+        results = {}
+        for i in range(0, len(identifiers), FILTER_CHUNK_SIZE):
+            results.update(
+                self.describe(identifiers[i:i + FILTER_CHUNK_SIZE]))
+            self.calls += 1
+        self.results = results
+        self.polled = set(identifiers)
+        self.refreshed = time.monotonic()
+
+    def get(self, identifier):
+        with self.lock:
+            if identifier not in self.watched:
+                self.watched[identifier] = 0
+            if self.stale(identifier):
+                self.refresh()
+            result = self.results.get(identifier)
+            if self.watched[identifier] == 0:
+                del self.watched[identifier]
+            return result
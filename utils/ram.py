@@ -0,0 +1,75 @@
+import logging
+from utils.iam import get_client, get_account_id_from_name
+from utils import waiter
+
+
+def share_resource(account, region, name, resource_arn, share_accounts):
+    # returns the ARN of the share, reusing an active share with the same
+    # name from an earlier run
+    client = get_client(account, 'ram', region)
+    principals = [get_account_id_from_name(sa) for sa in share_accounts]
+    response = client.get_resource_shares(
+        resourceOwner='SELF', name=name, resourceShareStatus='ACTIVE')
+    if len(response['resourceShares']):
+        share_arn = response['resourceShares'][0]['resourceShareArn']
+        logging.warning(f'Adding {resource_arn} and accounts ' +
+                        ' '.join(share_accounts) + f' to share {name}')
+        client.associate_resource_share(
+            resourceShareArn=share_arn,
+            resourceArns=[resource_arn],
+            principals=principals)
+        return share_arn
+
+    logging.warning(f'Sharing {resource_arn} with accounts ' +
+                    ' '.join(share_accounts) + f' as {name}')
+    response = client.create_resource_share(
+        name=name,
+        resourceArns=[resource_arn],
+        principals=principals,
+        allowExternalPrincipals=True)
+    return response['resourceShare']['resourceShareArn']
+
+
+def accept_resource_share(account, region, share_arn):
+    # shares within an organisation with RAM sharing enabled are accepted
+    # automatically, anything else waits on an invitation
+    client = get_client(account, 'ram', region)
+    response = client.get_resource_share_invitations(
+        resourceShareArns=[share_arn])
+    for invitation in response['resourceShareInvitations']:
+        if invitation['status'] == 'PENDING':
+            logging.warning(f'Accepting share {share_arn} in {account}')
+            client.accept_resource_share_invitation(
+                resourceShareInvitationArn=invitation[
+                    'resourceShareInvitationArn'])
+
+
+def poll_resource_share_associations(account, region, share_arn):
+    client = get_client(account, 'ram', region)
+    paginator = client.get_paginator('get_resource_share_associations')
+    statuses = set()
+    for association_type in ['PRINCIPAL', 'RESOURCE']:
+        for page in paginator.paginate(associationType=association_type,
+                                       resourceShareArns=[share_arn]):
+            for association in page['resourceShareAssociations']:
+                statuses.add(association['status'])
+    if 'FAILED' in statuses:
+        return 'FAILED', None
+    if statuses <= {'ASSOCIATED'}:
+        return 'ASSOCIATED', None
+    return 'ASSOCIATING', None
+
+
+def wait_for_resource_share(account, region, share_arn, timeout=None):
+    waiter.wait(f'Resource share {share_arn}',
+                lambda: poll_resource_share_associations(account, region,
+                                                         share_arn),
+                done=('ASSOCIATED',),
+                failed=('FAILED',),
+                timeout=timeout)
+
+
+def delete_resource_share(account, region, share_arn):
+    client = get_client(account, 'ram', region)
+    logging.warning(f'Deleting resource share {share_arn}')
+    client.delete_resource_share(resourceShareArn=share_arn)
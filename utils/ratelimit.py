@@ -0,0 +1,128 @@
+import math
+import time
+import logging
+import threading
+
+THROTTLE_ERROR_CODES = (
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException'
+)
+
+# requests per second and burst size used when no limit is configured
+DEFAULT_RATE = 10
+DEFAULT_BURST = 20
+
+limits = {}
+buckets = {}
+throttles = {}
+lock = threading.Lock()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def configure_rate_limit(rate, burst=None, account='*', region='*',
+                         service='*'):
+    # clients look their bucket up on every request, so a new limit applies
+    # to clients already built too
+    with lock:
+        limits[(account, region, service)] = (rate, burst or max(rate, 1))
+        buckets.clear()
+
+
+def parse_rate_limit(spec):
+    # specs look like rds=5, ap-southeast-2/rds=5 or prod/ap-southeast-2/rds=5
+    if '=' not in spec:
+        raise ValueError(f'Invalid rate limit {spec}, should be '
+                         '[[ACCOUNT/]REGION/]SERVICE=RATE')
+    key, rate = spec.split('=', 1)
+    parts = key.split('/')
+    if len(parts) > 3 or not all(parts):
+        raise ValueError(f'Invalid rate limit {spec}, should be '
+                         '[[ACCOUNT/]REGION/]SERVICE=RATE')
+    try:
+        rate = float(rate)
+    except ValueError:
+        raise ValueError(f'Invalid rate limit {spec}, should be '
+                         '[[ACCOUNT/]REGION/]SERVICE=RATE')
+    if not rate > 0 or not math.isfinite(rate):
+        raise ValueError(f'Rate limit {spec} must be a positive number '
+                         'of requests per second')
+    return ['*'] * (3 - len(parts)) + parts + [rate]
+
+
+def configure_rate_limits(specs):
+    for spec in specs:
+        account, region, service, rate = parse_rate_limit(spec)
+        configure_rate_limit(rate, account=account, region=region,
+                             service=service)
+
+
+def get_limit(account, region, service):
+    # most specific configured limit wins
+    for key in [(account, region, service), (account, '*', service),
+                ('*', region, service), ('*', '*', service),
+                (account, region, '*'), (account, '*', '*'),
+                ('*', region, '*'), ('*', '*', '*')]:
+        if key in limits:
+            return limits[key]
+    return DEFAULT_RATE, DEFAULT_BURST
+
+
+def get_bucket(account, region, service):
+    with lock:
+        key = (account, region, service)
+        if key not in buckets:
+            buckets[key] = TokenBucket(*get_limit(account, region, service))
+        return buckets[key]
+
+
+def get_throttle_counts():
+    with lock:
+        return {'/'.join(k): v for k, v in throttles.items()}
+
+
+def instrument_client(client, account, region, service):
+    # before-send fires for every attempt, retries included
+    def before_send(**kwargs):
+        get_bucket(account, region, service).acquire()
+
+    def needs_retry(response=None, operation=None, **kwargs):
+        if response is None:
+            return
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLE_ERROR_CODES:
+            with lock:
+                key = (account, region, service)
+                throttles[key] = throttles.get(key, 0) + 1
+            logging.info(f'{service} {operation.name} throttled in {account} '
+                         f'{region}: {code}')
+
+    client.meta.events.register('before-send', before_send)
+    client.meta.events.register('needs-retry', needs_retry)
+    return client
@@ -1,6 +1,112 @@
 import time
 import logging
+import threading
+from datetime import datetime, timedelta, timezone
 from utils.iam import get_client, get_account_id_from_name
+from utils.poller import BatchPoller
+from utils import waiter
+
+INSTANCE_FAILED_STATUSES = (
+    'failed',
+    'incompatible-restore',
+    'incompatible-parameters',
+    'incompatible-network',
+    'incompatible-option-group',
+    'inaccessible-encryption-credentials',
+    'restore-error',
+    'storage-full'
+)
+SNAPSHOT_FAILED_STATUSES = (
+    'failed',
+    'error',
+    'not-found'
+)
+
+CLUSTER_FAILED_STATUSES = (
+    'failed',
+    'inaccessible-encryption-credentials',
+    'incompatible-network',
+    'incompatible-parameters',
+    'incompatible-restore'
+)
+
+LINEAGE_TAG = 'rds-restore-lineage'
+# set on a restored instance once its storage has been warmed
+READY_TAG = 'rds-restore-ready'
+
+# RDS takes a moment to move an instance out of available after a modify or
+# reboot, waiting straight away would see the old status
+STATUS_CHANGE_DELAY = 10
+
+pollers = {}
+pollers_lock = threading.Lock()
+
+
+def to_tag_list(tags):
+    return [{'Key': k, 'Value': v} for k, v in tags.items()]
+
+
+def describe_rds_instances(account, region, db_instances):
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_instances')
+    instances = {}
+    for page in paginator.paginate(Filters=[{
+            'Name': 'db-instance-id',
+            'Values': db_instances}]):
+        for instance in page['DBInstances']:
+            instances[instance['DBInstanceIdentifier']] = instance
+    return instances
+
+
+def describe_rds_snapshots(account, region, snapshot_names):
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_snapshots')
+    snapshots = {}
+    for page in paginator.paginate(Filters=[{
+            'Name': 'db-snapshot-id',
+            'Values': snapshot_names}]):
+        for snapshot in page['DBSnapshots']:
+            snapshots[snapshot['DBSnapshotIdentifier']] = snapshot
+    return snapshots
+
+
+def describe_rds_clusters(account, region, db_clusters):
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_clusters')
+    clusters = {}
+    for page in paginator.paginate(Filters=[{
+            'Name': 'db-cluster-id',
+            'Values': db_clusters}]):
+        for cluster in page['DBClusters']:
+            clusters[cluster['DBClusterIdentifier']] = cluster
+    return clusters
+
+
+def describe_rds_cluster_snapshots(account, region, snapshot_names):
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_cluster_snapshots')
+    snapshots = {}
+    for page in paginator.paginate(Filters=[{
+            'Name': 'db-cluster-snapshot-id',
+            'Values': snapshot_names}]):
+        for snapshot in page['DBClusterSnapshots']:
+            snapshots[snapshot['DBClusterSnapshotIdentifier']] = snapshot
+    return snapshots
+
+
+def get_poller(account, region, kind):
+    describe = {
+        'instance': describe_rds_instances,
+        'snapshot': describe_rds_snapshots,
+        'cluster': describe_rds_clusters,
+        'cluster_snapshot': describe_rds_cluster_snapshots
+    }[kind]
+    with pollers_lock:
+        key = (account, region, kind)
+        if key not in pollers:
+            pollers[key] = BatchPoller(
+                lambda identifiers: describe(account, region, identifiers))
+        return pollers[key]
 
 
 def get_rds_instance_kms_key(account, region, db_instance):
@@ -11,6 +117,16 @@ def get_rds_instance_kms_key(account, region, db_instance):
     return None
 
 
+def get_rds_instance(account, region, db_instance):
+    client = get_client(account, 'rds', region)
+    try:
+        response = client.describe_db_instances(
+            DBInstanceIdentifier=db_instance)
+    except client.exceptions.DBInstanceNotFoundFault:
+        return None
+    return response['DBInstances'][0]
+
+
 def rds_instance_exists(account, region, db_instance):
     client = get_client(account, 'rds', region)
     try:
@@ -27,15 +143,29 @@ def get_rds_instance_status(account, region, db_instance):
     return response['DBInstances'][0]['DBInstanceStatus']
 
 
-def wait_for_rds_instance_status(account, region, db_instance, wait_status):
-    status = None
-    last_status = None
-    while status != wait_status:
-        status = get_rds_instance_status(account, region, db_instance)
-        if last_status != status:
-            last_status = status
-            logging.warning(f'DB {db_instance} status: {status}')
-        time.sleep(5)
+def poll_rds_instance_status(account, region, db_instance):
+    instance = get_poller(account, region, 'instance').get(db_instance)
+    if instance is None:
+        return 'deleted', None
+    return instance['DBInstanceStatus'], None
+
+
+def wait_for_rds_instance_status(account, region, db_instance, wait_status,
+                                 timeout=None, expected_duration=None):
+    if not isinstance(wait_status, tuple):
+        wait_status = (wait_status,)
+    poller = get_poller(account, region, 'instance')
+    poller.watch(db_instance)
+    try:
+        waiter.wait(f'DB {db_instance}',
+                    lambda: poll_rds_instance_status(account, region,
+                                                     db_instance),
+                    done=wait_status,
+                    failed=INSTANCE_FAILED_STATUSES + ('deleted',),
+                    timeout=timeout,
+                    expected_duration=expected_duration)
+    finally:
+        poller.unwatch(db_instance)
 
 
 def rds_snapshot_exists(account, region, snapshot_name):
@@ -47,24 +177,60 @@ def rds_snapshot_exists(account, region, snapshot_name):
     return True
 
 
+def get_rds_snapshot(account, region, snapshot_name):
+    client = get_client(account, 'rds', region)
+    try:
+        response = client.describe_db_snapshots(
+            DBSnapshotIdentifier=snapshot_name)
+    except client.exceptions.DBSnapshotNotFoundFault:
+        return None
+    return response['DBSnapshots'][0]
+
+
 def get_rds_snapshot_status(account, region, snapshot_name):
     client = get_client(account, 'rds', region)
     response = client.describe_db_snapshots(DBSnapshotIdentifier=snapshot_name)
     return response['DBSnapshots'][0]['Status']
 
 
+def poll_rds_snapshot_status(account, region, snapshot_name):
+    snapshot = get_poller(account, region, 'snapshot').get(snapshot_name)
+    if snapshot is None:
+        return 'not-found', None
+    return snapshot['Status'], snapshot.get('PercentProgress')
+
+
+def wait_for_rds_snapshot_status(account, region, snapshot_name, wait_status,
+                                 timeout=None, expected_duration=None,
+                                 failed=SNAPSHOT_FAILED_STATUSES):
+    if not isinstance(wait_status, tuple):
+        wait_status = (wait_status,)
+    poller = get_poller(account, region, 'snapshot')
+    poller.watch(snapshot_name)
+    try:
+        waiter.wait(f'Snapshot {snapshot_name}',
+                    lambda: poll_rds_snapshot_status(account, region,
+                                                     snapshot_name),
+                    done=wait_status,
+                    failed=failed,
+                    timeout=timeout,
+                    expected_duration=expected_duration)
+    finally:
+        poller.unwatch(snapshot_name)
+
+
 def delete_rds_snapshot(account, region, snapshot_name):
     client = get_client(account, 'rds', region)
     logging.warning(f'Deleting snapshot {snapshot_name}...')
-    status = None
-    while status != 'available' and status != 'failed':
-        status = get_rds_snapshot_status(account, region, snapshot_name)
-        time.sleep(5)
+    wait_for_rds_snapshot_status(
+        account, region, snapshot_name,
+        ('available',) + SNAPSHOT_FAILED_STATUSES, failed=())
     client.delete_db_snapshot(DBSnapshotIdentifier=snapshot_name)
 
 
 def create_rds_snapshot(account, region, db_instance, snapshot_name,
-                        wait=False):
+                        wait=False, timeout=None, tags=None,
+                        expected_duration=None):
     client = get_client(account, 'rds', region)
 
     if rds_snapshot_exists(account, region, snapshot_name):
@@ -72,19 +238,36 @@ def create_rds_snapshot(account, region, db_instance, snapshot_name,
         delete_rds_snapshot(account, region, snapshot_name)
 
     logging.warning(f'Creating snapshot {snapshot_name} from DB {db_instance}')
-    client.create_db_snapshot(
-        DBSnapshotIdentifier=snapshot_name,
-        DBInstanceIdentifier=db_instance)
+    args = {
+        'DBSnapshotIdentifier': snapshot_name,
+        'DBInstanceIdentifier': db_instance
+    }
+    if tags is not None:
+        args['Tags'] = to_tag_list(tags)
+    client.create_db_snapshot(**args)
 
     if wait is True:
-        status = None
-        last_status = None
-        while status != 'available':
-            status = get_rds_snapshot_status(account, region, snapshot_name)
-            if last_status != status:
-                last_status = status
-                logging.warning(f'Snapshot {snapshot_name} status: {status}')
-            time.sleep(5)
+        wait_for_rds_snapshot_status(account, region, snapshot_name,
+                                     'available', timeout=timeout,
+                                     expected_duration=expected_duration)
+
+
+def find_recent_rds_snapshot(account, region, db_instance, max_age):
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_snapshots')
+    oldest = datetime.now(tz=timezone.utc) - timedelta(minutes=max_age)
+    newest = None
+    for page in paginator.paginate(DBInstanceIdentifier=db_instance):
+        for snapshot in page['DBSnapshots']:
+            if snapshot['Status'] != 'available' or \
+                    snapshot['SnapshotType'] not in ('manual', 'automated'):
+                continue
+            if snapshot['SnapshotCreateTime'] < oldest:
+                continue
+            if newest is None or snapshot['SnapshotCreateTime'] > \
+                    newest['SnapshotCreateTime']:
+                newest = snapshot
+    return newest
 
 
 def share_rds_snapshot(account, region, snapshot_name, share_accounts):
@@ -103,7 +286,9 @@ def share_rds_snapshot(account, region, snapshot_name, share_accounts):
 
 
 def copy_rds_snapshot(source_account, region, dest_account, snapshot_name,
-                      dest_snapshot_name, kms_key, source_region, wait=False):
+                      dest_snapshot_name, source_region, kms_key=None,
+                      wait=False, timeout=None, tags=None,
+                      expected_duration=None):
     client = get_client(dest_account, 'rds', region)
     source_account_id = get_account_id_from_name(source_account)
     if rds_snapshot_exists(dest_account, region, dest_snapshot_name):
@@ -112,23 +297,44 @@ def copy_rds_snapshot(source_account, region, dest_account, snapshot_name,
 
     logging.warning(f'Copying RDS snapshot {snapshot_name} '
                     f'from {source_account} to {dest_account}')
-    client.copy_db_snapshot(
-        SourceDBSnapshotIdentifier=f'arn:aws:rds:{region}:{source_account_id}:snapshot:{snapshot_name}',  # noqa
-        TargetDBSnapshotIdentifier=dest_snapshot_name,
-        KmsKeyId=kms_key,
-        SourceRegion=source_region)
+    args = {
+        'SourceDBSnapshotIdentifier': f'arn:aws:rds:{source_region}:{source_account_id}:snapshot:{snapshot_name}',  # noqa
+        'TargetDBSnapshotIdentifier': dest_snapshot_name
+    }
+    if kms_key is not None:
+        args['KmsKeyId'] = kms_key
+    if source_region != region:
+        args['SourceRegion'] = source_region
+    if tags is not None:
+        args['Tags'] = to_tag_list(tags)
+    client.copy_db_snapshot(**args)
 
     if wait is True:
-        status = None
-        last_status = None
-        while status != 'available':
-            status = get_rds_snapshot_status(dest_account, region,
-                                             dest_snapshot_name)
-            if last_status != status:
-                last_status = status
-                logging.warning(f'Snapshot {dest_snapshot_name} status: '
-                                f'{status}')
-            time.sleep(5)
+        wait_for_rds_snapshot_status(dest_account, region, dest_snapshot_name,
+                                     'available', timeout=timeout,
+                                     expected_duration=expected_duration)
+
+
+def prune_rds_snapshots(account, region, lineage, retain):
+    # keep the newest snapshots of a lineage, an earlier copy has to exist in
+    # the target for RDS to copy incrementally
+    client = get_client(account, 'rds', region)
+    paginator = client.get_paginator('describe_db_snapshots')
+    snapshots = []
+    for page in paginator.paginate(SnapshotType='manual'):
+        for snapshot in page['DBSnapshots']:
+            tags = {t['Key']: t['Value'] for t in snapshot.get('TagList', [])}
+            if tags.get(LINEAGE_TAG) == lineage:
+                snapshots.append(snapshot)
+    snapshots.sort(key=lambda s: s['SnapshotCreateTime'], reverse=True)
+    for snapshot in snapshots[retain:]:
+        if snapshot['Status'] != 'available':
+            continue
+        logging.warning(f'Pruning snapshot '
+                        f'{snapshot["DBSnapshotIdentifier"]} of lineage '
+                        f'{lineage}')
+        client.delete_db_snapshot(
+            DBSnapshotIdentifier=snapshot['DBSnapshotIdentifier'])
 
 
 def delete_rds_instance(account, region, db_instance, wait=False):
@@ -138,34 +344,135 @@ def delete_rds_instance(account, region, db_instance, wait=False):
         DBInstanceIdentifier=db_instance,
         SkipFinalSnapshot=True)
     if wait is True:
-        while rds_instance_exists(account, region, db_instance):
-            time.sleep(5)
+        wait_for_rds_instance_deleted(account, region, db_instance)
+
+
+def wait_for_rds_instance_deleted(account, region, db_instance, timeout=None):
+    poller = get_poller(account, region, 'instance')
+    poller.watch(db_instance)
+    try:
+        waiter.wait(f'DB {db_instance}',
+                    lambda: poll_rds_instance_status(account, region,
+                                                     db_instance),
+                    done=('deleted',),
+                    timeout=timeout)
+    finally:
+        poller.unwatch(db_instance)
+
+
+def get_instance_restore_args(db_instance_type, subnet_group, multi_az,
+                              public, option_group, storage_type,
+                              vpc_security_groups, parameter_group, iops,
+                              storage_throughput, tags):
+    # apply as much as possible at creation time, each later modify costs a
+    # round of status changes
+    args = {
+        'DBInstanceClass': db_instance_type,
+        'DBSubnetGroupName': subnet_group,
+        'MultiAZ': multi_az,
+        'PubliclyAccessible': public,
+        'OptionGroupName': option_group,
+        'StorageType': storage_type,
+        'CopyTagsToSnapshot': True
+    }
+    if vpc_security_groups:
+        if not isinstance(vpc_security_groups, list):
+            vpc_security_groups = [vpc_security_groups]
+        args['VpcSecurityGroupIds'] = vpc_security_groups
+    if parameter_group is not None:
+        args['DBParameterGroupName'] = parameter_group
+    if iops is not None:
+        args['Iops'] = iops
+    if storage_throughput is not None:
+        args['StorageThroughput'] = storage_throughput
+    if tags:
+        args['Tags'] = to_tag_list(tags)
+    return args
 
 
 def restore_db_from_snapshot(account, region, snapshot_name, db_instance,
                              db_instance_type, subnet_group, multi_az, public,
-                             option_group, storage_type, wait=False):
+                             option_group, storage_type, wait=False,
+                             vpc_security_groups=None, parameter_group=None,
+                             iops=None, storage_throughput=None, tags=None,
+                             expected_duration=None):
     client = get_client(account, 'rds', region)
 
     if rds_instance_exists(account, region, db_instance):
         logging.warning(f'DB {db_instance} exists.')
         delete_rds_instance(account, region, db_instance, True)
 
+    args = get_instance_restore_args(
+        db_instance_type, subnet_group, multi_az, public, option_group,
+        storage_type, vpc_security_groups, parameter_group, iops,
+        storage_throughput, tags)
+    args['DBInstanceIdentifier'] = db_instance
+    args['DBSnapshotIdentifier'] = snapshot_name
+
     logging.warning(f'Restoring DB {db_instance} from snapshot '
                     f'{snapshot_name}..')
-    client.restore_db_instance_from_db_snapshot(
-        DBInstanceIdentifier=db_instance,
-        DBSnapshotIdentifier=snapshot_name,
-        DBInstanceClass=db_instance_type,
-        DBSubnetGroupName=subnet_group,
-        MultiAZ=multi_az,
-        PubliclyAccessible=public,
-        OptionGroupName=option_group,
-        StorageType=storage_type,
-        CopyTagsToSnapshot=True)
+    client.restore_db_instance_from_db_snapshot(**args)
 
     if wait is True:
-        wait_for_rds_instance_status(account, region, db_instance, 'available')
+        wait_for_rds_instance_status(account, region, db_instance, 'available',
+                                     expected_duration=expected_duration)
+
+
+def get_automated_backups(instance, region):
+    # regions the instance can be restored to a point in time in, with the
+    # ARN of the automated backups replicated there. The instance's own
+    # region has no ARN, restores there name the instance instead
+    backups = {}
+    if instance.get('BackupRetentionPeriod'):
+        backups[region] = None
+    for replication in instance.get('DBInstanceAutomatedBackupsReplications',
+                                    []):
+        arn = replication['DBInstanceAutomatedBackupsArn']
+        backups[arn.split(':')[3]] = arn
+    return backups
+
+
+def restore_db_to_point_in_time(account, region, db_instance,
+                                db_instance_type, subnet_group, multi_az,
+                                public, option_group, storage_type,
+                                source_db_instance=None,
+                                source_backups_arn=None, restore_time=None,
+                                wait=False, vpc_security_groups=None,
+                                parameter_group=None, iops=None,
+                                storage_throughput=None, tags=None,
+                                expected_duration=None):
+    # restores from the source instance's automated backups, or from backups
+    # replicated to this region, at restore_time or the latest restorable
+    # time. No snapshot has to be taken first
+    client = get_client(account, 'rds', region)
+
+    if rds_instance_exists(account, region, db_instance):
+        logging.warning(f'DB {db_instance} exists.')
+        delete_rds_instance(account, region, db_instance, True)
+
+    args = get_instance_restore_args(
+        db_instance_type, subnet_group, multi_az, public, option_group,
+        storage_type, vpc_security_groups, parameter_group, iops,
+        storage_throughput, tags)
+    args['TargetDBInstanceIdentifier'] = db_instance
+    source = source_db_instance
+    if source_backups_arn is not None:
+        args['SourceDBInstanceAutomatedBackupsArn'] = source_backups_arn
+        source = source_backups_arn
+    else:
+        args['SourceDBInstanceIdentifier'] = source_db_instance
+    if restore_time is not None:
+        args['RestoreTime'] = restore_time
+    else:
+        args['UseLatestRestorableTime'] = True
+
+    logging.warning(f'Restoring DB {db_instance} from {source} at '
+                    f'{restore_time or "the latest restorable time"}..')
+    client.restore_db_instance_to_point_in_time(**args)
+
+    if wait is True:
+        wait_for_rds_instance_status(account, region, db_instance, 'available',
+                                     expected_duration=expected_duration)
 
 
 def modify_db_instance(account, region, db_instance, db_security_groups=None,
@@ -190,17 +497,395 @@ def modify_db_instance(account, region, db_instance, db_security_groups=None,
 
     logging.warning(f'Modifying DB instance {db_instance}')
     client.modify_db_instance(**args)
-    time.sleep(10)
+    time.sleep(STATUS_CHANGE_DELAY)
 
     if wait is True:
         wait_for_rds_instance_status(account, region, db_instance, 'available')
 
 
+def tag_db_instance(account, region, db_instance, tags):
+    client = get_client(account, 'rds', region)
+    instance = get_rds_instance(account, region, db_instance)
+    logging.warning(f'Tagging DB instance {db_instance} with ' +
+                    ' '.join(f'{k}={v}' for k, v in tags.items()))
+    client.add_tags_to_resource(ResourceName=instance['DBInstanceArn'],
+                                Tags=to_tag_list(tags))
+
+
+def resize_db_instance(account, region, db_instance, db_instance_type,
+                       storage_type=None, iops=None, storage_throughput=None,
+                       wait=False, expected_duration=None):
+    # changes are applied now rather than in the maintenance window. RDS
+    # keeps optimising changed storage for hours afterwards, the instance
+    # is usable meanwhile so that counts as done
+    client = get_client(account, 'rds', region)
+    args = {
+        'DBInstanceIdentifier': db_instance,
+        'DBInstanceClass': db_instance_type,
+        'ApplyImmediately': True
+    }
+    if storage_type is not None:
+        args['StorageType'] = storage_type
+    if iops is not None:
+        args['Iops'] = iops
+    if storage_throughput is not None:
+        args['StorageThroughput'] = storage_throughput
+
+    logging.warning(f'Resizing DB instance {db_instance} to '
+                    f'{db_instance_type}' +
+                    (f' with {storage_type} storage' if storage_type else ''))
+    client.modify_db_instance(**args)
+    time.sleep(STATUS_CHANGE_DELAY)
+
+    if wait is True:
+        wait_for_rds_instance_status(
+            account, region, db_instance,
+            ('available', 'storage-optimization'),
+            expected_duration=expected_duration)
+
+
+def rds_instance_needs_reboot(account, region, db_instance):
+    instance = get_rds_instance(account, region, db_instance)
+    return any(group['ParameterApplyStatus'] == 'pending-reboot'
+               for group in instance.get('DBParameterGroups', []))
+
+
+def rename_db_instance(account, region, db_instance, new_name, wait=False):
+    client = get_client(account, 'rds', region)
+    logging.warning(f'Renaming DB instance {db_instance} to {new_name}')
+    client.modify_db_instance(
+        DBInstanceIdentifier=db_instance,
+        NewDBInstanceIdentifier=new_name,
+        ApplyImmediately=True)
+    if wait is True:
+        wait_for_rds_instance_deleted(account, region, db_instance)
+        # a resized DB goes back to optimising its storage after the rename
+        wait_for_rds_instance_status(account, region, new_name,
+                                     ('available', 'storage-optimization'))
+
+
 def reboot_db_instance(account, region, db_instance, wait=False):
     client = get_client(account, 'rds', region)
     wait_for_rds_instance_status(account, region, db_instance, 'available')
     logging.warning(f'Rebooting DB instance {db_instance}...')
     client.reboot_db_instance(DBInstanceIdentifier=db_instance)
-    time.sleep(10)
+    time.sleep(STATUS_CHANGE_DELAY)
     if wait is True:
         wait_for_rds_instance_status(account, region, db_instance, 'available')
+
+
+def get_rds_cluster(account, region, db_cluster):
+    client = get_client(account, 'rds', region)
+    try:
+        response = client.describe_db_clusters(DBClusterIdentifier=db_cluster)
+    except client.exceptions.DBClusterNotFoundFault:
+        return None
+    return response['DBClusters'][0]
+
+
+def poll_rds_cluster_status(account, region, db_cluster):
+    cluster = get_poller(account, region, 'cluster').get(db_cluster)
+    if cluster is None:
+        return 'deleted', None
+    return cluster['Status'], None
+
+
+def wait_for_rds_cluster_status(account, region, db_cluster, wait_status,
+                                timeout=None, expected_duration=None):
+    if not isinstance(wait_status, tuple):
+        wait_status = (wait_status,)
+    poller = get_poller(account, region, 'cluster')
+    poller.watch(db_cluster)
+    try:
+        waiter.wait(f'Cluster {db_cluster}',
+                    lambda: poll_rds_cluster_status(account, region,
+                                                    db_cluster),
+                    done=wait_status,
+                    failed=CLUSTER_FAILED_STATUSES + ('deleted',),
+                    timeout=timeout,
+                    expected_duration=expected_duration)
+    finally:
+        poller.unwatch(db_cluster)
+
+
+def wait_for_rds_cluster_deleted(account, region, db_cluster, timeout=None):
+    poller = get_poller(account, region, 'cluster')
+    poller.watch(db_cluster)
+    try:
+        waiter.wait(f'Cluster {db_cluster}',
+                    lambda: poll_rds_cluster_status(account, region,
+                                                    db_cluster),
+                    done=('deleted',),
+                    timeout=timeout)
+    finally:
+        poller.unwatch(db_cluster)
+
+
+def get_rds_cluster_snapshot(account, region, snapshot_name):
+    client = get_client(account, 'rds', region)
+    try:
+        response = client.describe_db_cluster_snapshots(
+            DBClusterSnapshotIdentifier=snapshot_name)
+    except client.exceptions.DBClusterSnapshotNotFoundFault:
+        return None
+    return response['DBClusterSnapshots'][0]
+
+
+def poll_rds_cluster_snapshot_status(account, region, snapshot_name):
+    snapshot = get_poller(account, region, 'cluster_snapshot').get(
+        snapshot_name)
+    if snapshot is None:
+        return 'not-found', None
+    return snapshot['Status'], snapshot.get('PercentProgress')
+
+
+def wait_for_rds_cluster_snapshot_status(account, region, snapshot_name,
+                                         wait_status, timeout=None,
+                                         expected_duration=None,
+                                         failed=SNAPSHOT_FAILED_STATUSES):
+    if not isinstance(wait_status, tuple):
+        wait_status = (wait_status,)
+    poller = get_poller(account, region, 'cluster_snapshot')
+    poller.watch(snapshot_name)
+    try:
+        waiter.wait(f'Cluster snapshot {snapshot_name}',
+                    lambda: poll_rds_cluster_snapshot_status(
+                        account, region, snapshot_name),
+                    done=wait_status,
+                    failed=failed,
+                    timeout=timeout,
+                    expected_duration=expected_duration)
+    finally:
+        poller.unwatch(snapshot_name)
+
+
+def delete_rds_cluster_snapshot(account, region, snapshot_name):
+    client = get_client(account, 'rds', region)
+    logging.warning(f'Deleting cluster snapshot {snapshot_name}...')
+    wait_for_rds_cluster_snapshot_status(
+        account, region, snapshot_name,
+        ('available',) + SNAPSHOT_FAILED_STATUSES, failed=())
+    client.delete_db_cluster_snapshot(
+        DBClusterSnapshotIdentifier=snapshot_name)
+
+
+def create_rds_cluster_snapshot(account, region, db_cluster, snapshot_name,
+                                wait=False, timeout=None, tags=None,
+                                expected_duration=None):
+    client = get_client(account, 'rds', region)
+
+    if get_rds_cluster_snapshot(account, region, snapshot_name) is not None:
+        logging.warning(f'Cluster snapshot {snapshot_name} exists...')
+        delete_rds_cluster_snapshot(account, region, snapshot_name)
+
+    logging.warning(f'Creating cluster snapshot {snapshot_name} from '
+                    f'cluster {db_cluster}')
+    args = {
+        'DBClusterSnapshotIdentifier': snapshot_name,
+        'DBClusterIdentifier': db_cluster
+    }
+    if tags is not None:
+        args['Tags'] = to_tag_list(tags)
+    client.create_db_cluster_snapshot(**args)
+
+    if wait is True:
+        wait_for_rds_cluster_snapshot_status(
+            account, region, snapshot_name, 'available', timeout=timeout,
+            expected_duration=expected_duration)
+
+
+def share_rds_cluster_snapshot(account, region, snapshot_name,
+                               share_accounts):
+    if not isinstance(share_accounts, list):
+        share_accounts = [share_accounts]
+    client = get_client(account, 'rds', region)
+    logging.warning(f'Sharing cluster snapshot {snapshot_name} with '
+                    f'accounts ' + ' '.join(share_accounts))
+    client.modify_db_cluster_snapshot_attribute(
+        DBClusterSnapshotIdentifier=snapshot_name,
+        AttributeName='restore',
+        ValuesToAdd=[get_account_id_from_name(sa) for sa in share_accounts])
+
+
+def copy_rds_cluster_snapshot(source_account, region, dest_account,
+                              snapshot_name, dest_snapshot_name,
+                              source_region, kms_key=None, wait=False,
+                              timeout=None, tags=None,
+                              expected_duration=None):
+    client = get_client(dest_account, 'rds', region)
+    source_account_id = get_account_id_from_name(source_account)
+    if get_rds_cluster_snapshot(dest_account, region,
+                                dest_snapshot_name) is not None:
+        logging.warning(f'Destination cluster snapshot {dest_snapshot_name} '
+                        f'exists...')
+        delete_rds_cluster_snapshot(dest_account, region, dest_snapshot_name)
+
+    logging.warning(f'Copying cluster snapshot {snapshot_name} '
+                    f'from {source_account} to {dest_account}')
+    args = {
+        'SourceDBClusterSnapshotIdentifier': f'arn:aws:rds:{source_region}:{source_account_id}:cluster-snapshot:{snapshot_name}',  # noqa
+        'TargetDBClusterSnapshotIdentifier': dest_snapshot_name
+    }
+    if kms_key is not None:
+        args['KmsKeyId'] = kms_key
+    if source_region != region:
+        args['SourceRegion'] = source_region
+    if tags is not None:
+        args['Tags'] = to_tag_list(tags)
+    client.copy_db_cluster_snapshot(**args)
+
+    if wait is True:
+        wait_for_rds_cluster_snapshot_status(
+            dest_account, region, dest_snapshot_name, 'available',
+            timeout=timeout, expected_duration=expected_duration)
+
+
+def delete_rds_cluster(account, region, db_cluster, wait=False):
+    # a cluster can only be deleted once its instances are gone
+    client = get_client(account, 'rds', region)
+    cluster = get_rds_cluster(account, region, db_cluster)
+    members = [m['DBInstanceIdentifier']
+               for m in cluster.get('DBClusterMembers', [])]
+    for db_instance in members:
+        delete_rds_instance(account, region, db_instance)
+    for db_instance in members:
+        wait_for_rds_instance_deleted(account, region, db_instance)
+
+    logging.warning(f'Deleting RDS cluster {db_cluster}')
+    client.delete_db_cluster(
+        DBClusterIdentifier=db_cluster,
+        SkipFinalSnapshot=True)
+    if wait is True:
+        wait_for_rds_cluster_deleted(account, region, db_cluster)
+
+
+def get_cluster_restore_args(db_cluster, subnet_group, vpc_security_groups,
+                             parameter_group, kms_key, tags):
+    args = {
+        'DBClusterIdentifier': db_cluster,
+        'DBSubnetGroupName': subnet_group,
+        'CopyTagsToSnapshot': True
+    }
+    if vpc_security_groups:
+        if not isinstance(vpc_security_groups, list):
+            vpc_security_groups = [vpc_security_groups]
+        args['VpcSecurityGroupIds'] = vpc_security_groups
+    if parameter_group is not None:
+        args['DBClusterParameterGroupName'] = parameter_group
+    if kms_key is not None:
+        args['KmsKeyId'] = kms_key
+    if tags:
+        args['Tags'] = to_tag_list(tags)
+    return args
+
+
+def restore_db_cluster_from_snapshot(account, region, snapshot_name,
+                                     db_cluster, subnet_group, wait=False,
+                                     vpc_security_groups=None,
+                                     parameter_group=None, kms_key=None,
+                                     tags=None, expected_duration=None):
+    client = get_client(account, 'rds', region)
+
+    if get_rds_cluster(account, region, db_cluster) is not None:
+        logging.warning(f'Cluster {db_cluster} exists.')
+        delete_rds_cluster(account, region, db_cluster, True)
+
+    snapshot = get_rds_cluster_snapshot(account, region, snapshot_name)
+    if snapshot is None:
+        raise ValueError(f'Cluster snapshot {snapshot_name} not found in '
+                         f'{account} {region}')
+    args = get_cluster_restore_args(db_cluster, subnet_group,
+                                    vpc_security_groups, parameter_group,
+                                    kms_key, tags)
+    args.update({
+        'SnapshotIdentifier': snapshot_name,
+        'Engine': snapshot['Engine'],
+        'EngineVersion': snapshot['EngineVersion']
+    })
+
+    logging.warning(f'Restoring cluster {db_cluster} from snapshot '
+                    f'{snapshot_name}..')
+    client.restore_db_cluster_from_snapshot(**args)
+
+    if wait is True:
+        wait_for_rds_cluster_status(account, region, db_cluster, 'available',
+                                    expected_duration=expected_duration)
+
+
+def clone_db_cluster(account, region, source_cluster_arn, db_cluster,
+                     subnet_group, wait=False, vpc_security_groups=None,
+                     parameter_group=None, kms_key=None, tags=None,
+                     expected_duration=None):
+    # a copy-on-write clone shares storage with the source, so it's ready in
+    # minutes whatever the size of the cluster. The source must be in the
+    # same region, and shared through RAM when in another account
+    client = get_client(account, 'rds', region)
+
+    if get_rds_cluster(account, region, db_cluster) is not None:
+        logging.warning(f'Cluster {db_cluster} exists.')
+        delete_rds_cluster(account, region, db_cluster, True)
+
+    args = get_cluster_restore_args(db_cluster, subnet_group,
+                                    vpc_security_groups, parameter_group,
+                                    kms_key, tags)
+    args.update({
+        'SourceDBClusterIdentifier': source_cluster_arn,
+        'RestoreType': 'copy-on-write',
+        'UseLatestRestorableTime': True
+    })
+
+    logging.warning(f'Cloning cluster {source_cluster_arn} to {db_cluster}')
+    client.restore_db_cluster_to_point_in_time(**args)
+
+    if wait is True:
+        wait_for_rds_cluster_status(account, region, db_cluster, 'available',
+                                    expected_duration=expected_duration)
+
+
+def create_cluster_instance(account, region, db_cluster, db_instance,
+                            db_instance_type, public, parameter_group=None,
+                            tags=None, wait=False, expected_duration=None):
+    # restored and cloned clusters have no instances, the first one created
+    # becomes the writer
+    client = get_client(account, 'rds', region)
+    cluster = get_rds_cluster(account, region, db_cluster)
+    args = {
+        'DBInstanceIdentifier': db_instance,
+        'DBClusterIdentifier': db_cluster,
+        'DBInstanceClass': db_instance_type,
+        'Engine': cluster['Engine'],
+        'PubliclyAccessible': public
+    }
+    if parameter_group is not None:
+        args['DBParameterGroupName'] = parameter_group
+    if tags:
+        args['Tags'] = to_tag_list(tags)
+
+    logging.warning(f'Creating DB instance {db_instance} in cluster '
+                    f'{db_cluster}')
+    client.create_db_instance(**args)
+
+    if wait is True:
+        wait_for_rds_instance_status(account, region, db_instance, 'available',
+                                     expected_duration=expected_duration)
+
+
+def modify_db_cluster(account, region, db_cluster, master_password=None,
+                      wait=False):
+    client = get_client(account, 'rds', region)
+    args = {}
+    if master_password is not None:
+        args['MasterUserPassword'] = master_password
+
+    if args == {}:
+        return
+
+    args['DBClusterIdentifier'] = db_cluster
+    args['ApplyImmediately'] = True
+
+    logging.warning(f'Modifying cluster {db_cluster}')
+    client.modify_db_cluster(**args)
+    time.sleep(STATUS_CHANGE_DELAY)
+
+    if wait is True:
+        wait_for_rds_cluster_status(account, region, db_cluster, 'available')
@@ -1,72 +1,177 @@
 from utils.iam import get_client
+from utils import metrics, waiter
 import logging
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+# GetParameters accepts at most 10 names per call
+GET_PARAMETERS_CHUNK_SIZE = 10
 
-def get_parameter(account, region, parameter_name):
+COMMAND_FINISHED_STATUSES = (
+    'Success',
+    'Cancelled',
+    'Failed',
+    'TimedOut'
+)
+
+parameters_lock = threading.Lock()
+
+
+def get_parameters(account, region, parameter_names, parameters=None):
+    # parameters caches values for the caller, e.g. for the length of one
+    # run, so rotated passwords and groups are picked up by the next one
+    if parameters is None:
+        parameters = {}
     client = get_client(account, 'ssm', region)
-    logging.warning(f'Getting value for parameter {parameter_name}')
-    response = client.get_parameter(Name=parameter_name, WithDecryption=True)
-    return response['Parameter']['Value']
-
-
-def wait_for_command(account, region, command_id, instances):
-    completions = 0
-    completed_statuses = [
-        'Success',
-        'Cancelled',
-        'Failed',
-        'TimedOut'
-    ]
-    while True:
-        for instance in instances:
-            status = get_command_invocation_status(
-                account, region, command_id, instance)
-            if status in completed_statuses:
-                logging.warning(f'Command {command_id} finished on '
-                                f'{instance} with status {status}')
-                completions += 1
-        if completions >= len(instances):
-            break
-        time.sleep(5)
-    logging.warning(f'Command {command_id} finished on all instances.')
-
-
-def run_command(account, region, command, instance_name):
+    with parameters_lock:
+        fetch = sorted(set(
+            name for name in parameter_names
+            if (account, region, name) not in parameters))
+    missing = []
+    for i in range(0, len(fetch), GET_PARAMETERS_CHUNK_SIZE):
+        names = fetch[i:i + GET_PARAMETERS_CHUNK_SIZE]
+        logging.warning('Getting values for parameters ' + ' '.join(names))
+        response = client.get_parameters(Names=names, WithDecryption=True)
+        with parameters_lock:
+            for parameter in response['Parameters']:
+                parameters[(account, region, parameter['Name'])] = \
+                    parameter['Value']
+        missing.extend(response['InvalidParameters'])
+
+    if len(missing):
+        raise ValueError(f'SSM parameters not found in {account} {region}: ' +
+                         ' '.join(missing))
+
+    with parameters_lock:
+        return {name: parameters[(account, region, name)]
+                for name in parameter_names}
+
+
+def get_parameter(account, region, parameter_name, parameters=None):
+    return get_parameters(account, region, [parameter_name],
+                          parameters)[parameter_name]
+
+
+class CommandTracker:
+    # Follows one command across every instance it targets. Each poll lists
+    # the invocations of the command in bulk, and each instance's final
+    # status is recorded, and reported, exactly once.
+
+    def __init__(self, account, region, command_id, on_result=None):
+        self.account = account
+        self.region = region
+        self.command_id = command_id
+        self.on_result = on_result or log_command_result
+        self.results = {}
+        self.status = None
+        self.target_count = None
+
+    def poll(self):
+        client = get_client(self.account, 'ssm', self.region)
+        command = client.list_commands(
+            CommandId=self.command_id)['Commands'][0]
+        self.status = command['Status']
+        self.target_count = command['TargetCount']
+
+        pending = 0
+        for instance, invocation in list_command_invocations(
+                self.account, self.region, self.command_id).items():
+            if instance in self.results:
+                continue
+            if invocation['Status'] not in COMMAND_FINISHED_STATUSES:
+                pending += 1
+                continue
+            self.results[instance] = invocation['Status']
+            self.on_result(self.command_id, instance, invocation)
+
+        # once the error budget is spent SSM finishes the command without
+        # invoking the remaining targets, so don't wait on the target count
+        if self.status in COMMAND_FINISHED_STATUSES and not pending:
+            return 'finished', 100
+        progress = None
+        if self.target_count:
+            progress = 100 * len(self.results) / self.target_count
+        return self.status, progress
+
+    def failed_instances(self):
+        return sorted(instance for instance, status in self.results.items()
+                      if status != 'Success')
+
+
+def log_command_result(command_id, instance, invocation):
+    logging.warning(f'Command {command_id} finished on {instance} with '
+                    f'status {invocation["Status"]}')
+
+
+def list_command_invocations(account, region, command_id):
+    client = get_client(account, 'ssm', region)
+    paginator = client.get_paginator('list_command_invocations')
+    invocations = {}
+    for page in paginator.paginate(CommandId=command_id):
+        for invocation in page['CommandInvocations']:
+            invocations[invocation['InstanceId']] = invocation
+    return invocations
+
+
+def wait_for_command(account, region, command_id, timeout=None,
+                     on_result=None):
+    tracker = CommandTracker(account, region, command_id, on_result)
+    waiter.wait(f'Command {command_id}', tracker.poll, done=('finished',),
+                timeout=timeout)
+    logging.warning(f'Command {command_id} finished on '
+                    f'{len(tracker.results)} instances with status '
+                    f'{tracker.status}.')
+    return tracker
+
+
+def run_command(account, region, command, instance_name,
+                max_concurrency=None, max_errors=None, on_result=None,
+                parameters=None):
     client = get_client(account, 'ssm', region)
     logging.warning(f'Running command {command} on instances with name '
                     f'{instance_name}')
-    response = client.send_command(
-        Targets=[{
+    args = {
+        'Targets': [{
             'Key': 'tag:Name',
             'Values': [instance_name]
         }],
-        DocumentName=command)
+        'DocumentName': command
+    }
+    if max_concurrency is not None:
+        args['MaxConcurrency'] = max_concurrency
+    if max_errors is not None:
+        args['MaxErrors'] = max_errors
+    if parameters is not None:
+        args['Parameters'] = parameters
+    response = client.send_command(**args)
     command_id = response['Command']['CommandId']
-    instances = get_command_invocation_instances(account, region, command_id)
     logging.warning(f'Waiting for command {command_id} to finish executing.')
-    wait_for_command(account, region, command_id, instances)
+    tracker = wait_for_command(account, region, command_id,
+                               on_result=on_result)
 
+    # with an error budget set, SSM fails the command once it's exceeded
+    if max_errors is not None and tracker.status != 'Success':
+        raise ValueError(f'Command {command} {command_id} finished with '
+                         f'status {tracker.status}, failed on ' +
+                         ' '.join(tracker.failed_instances()))
+    return tracker.results
 
-def get_command_invocation_instances(account, region, command_id):
-    client = get_client(account, 'ssm', region)
-    instances = []
-    args = {
-        'CommandId': command_id
-    }
-    while True:
-        response = client.list_command_invocations(**args)
-        if 'NextToken' in response and response['NextToken'] != '':
-            args['NextToken'] = response['NextToken']
-        else:
-            break
-    for invocation in response['CommandInvocations']:
-        instances.append(invocation['InstanceId'])
-    return instances
-
-
-def get_command_invocation_status(account, region, command_id, instance_id):
-    client = get_client(account, 'ssm', region)
-    response = client.get_command_invocation(
-        CommandId=command_id, InstanceId=instance_id)
-    return response['Status']
+
+def run_command_stages(account, region, commands, max_concurrency=None,
+                       max_errors=None):
+    # commands are (stage, command, instance name) tuples. Stages run in
+    # order, the commands within a stage run at the same time
+    stages = {}
+    for stage, command, instance_name in commands:
+        stages.setdefault(stage, []).append((command, instance_name))
+
+    for stage in sorted(stages):
+        with ThreadPoolExecutor(max_workers=len(stages[stage])) as executor:
+            # the commands' waits count towards the stage running them
+            futures = [executor.submit(
+                metrics.bind_span(run_command), account, region, command,
+                instance_name, max_concurrency=max_concurrency,
+                max_errors=max_errors)
+                for command, instance_name in stages[stage]]
+            for future in futures:
+                future.result()
@@ -0,0 +1,118 @@
+import time
+import random
+import logging
+from utils import metrics as trace
+
+MIN_DELAY = 5
+MAX_DELAY = 60
+BACKOFF = 1.5
+JITTER = 0.1
+# the longest any single wait may take unless the caller says otherwise,
+# so a resource stuck in one status fails the restore rather than hanging it
+TIMEOUT = 24 * 3600
+
+
+class WaiterError(Exception):
+    pass
+
+
+class WaiterFailure(WaiterError):
+    pass
+
+
+class WaiterTimeout(WaiterError):
+    pass
+
+
+def configure(min_delay=None, max_delay=None, backoff=None, timeout=None):
+    global MIN_DELAY, MAX_DELAY, BACKOFF, TIMEOUT
+    if min_delay is not None:
+        MIN_DELAY = min_delay
+    if max_delay is not None:
+        MAX_DELAY = max_delay
+    if backoff is not None:
+        BACKOFF = backoff
+    if timeout is not None:
+        TIMEOUT = timeout
+
+
+def estimate_remaining(elapsed, progress, expected_duration):
+    # prefer the progress AWS reports, fall back to how long we expected the
+    # wait to take
+    if progress is not None and 0 < progress < 100:
+        return elapsed / progress * (100 - progress)
+    if expected_duration is not None:
+        return max(expected_duration - elapsed, 0)
+    return None
+
+
+def next_delay(delay, elapsed, progress, expected_duration):
+    remaining = estimate_remaining(elapsed, progress, expected_duration)
+    if remaining is not None:
+        # poll a few times over what's left so we don't overshoot completion
+        # by more than a fraction of the remaining time
+        delay = remaining / 4
+    else:
+        delay = delay * BACKOFF
+    delay = min(max(delay, MIN_DELAY), MAX_DELAY)
+    return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+def wait(name, poll, done, failed=(), timeout=None, expected_duration=None):
+    # poll returns a (status, progress) tuple, progress being a percentage
+    # or None when the resource doesn't report one
+    if timeout is None:
+        timeout = TIMEOUT
+    start = time.monotonic()
+    started = time.time()
+    delay = MIN_DELAY
+    polls = 0
+    status = None
+    last_status = None
+    result = 'done'
+
+    try:
+        while True:
+            status, progress = poll()
+            polls += 1
+            elapsed = time.monotonic() - start
+
+            if status != last_status:
+                last_status = status
+                delay = MIN_DELAY
+                remaining = estimate_remaining(elapsed, progress,
+                                               expected_duration)
+                if remaining is None or status in done:
+                    logging.warning(f'{name} status: {status}')
+                else:
+                    logging.warning(f'{name} status: {status}, about '
+                                    f'{int(remaining)}s remaining')
+
+            if status in done:
+                break
+            if status in failed:
+                result = 'failed'
+                raise WaiterFailure(f'{name} entered terminal status '
+                                    f'{status}')
+            if elapsed >= timeout:
+                result = 'timeout'
+                raise WaiterTimeout(f'Timed out after {int(elapsed)}s '
+                                    f'waiting for {name}, last status '
+                                    f'{status}')
+
+            delay = next_delay(delay, elapsed, progress, expected_duration)
+            delay = min(delay, max(timeout - elapsed, 0))
+            time.sleep(delay)
+    finally:
+        elapsed = time.monotonic() - start
+        trace.add_wait({
+            'name': name,
+            'start': started,
+            'result': result,
+            'status': status,
+            'polls': polls,
+            'seconds': round(elapsed, 3)
+        })
+        logging.info(f'{name}: {result} after {polls} polls in '
+                     f'{int(elapsed)}s')
+    return status
@@ -0,0 +1,263 @@
+import re
+import time
+import shlex
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.iam import get_client
+from utils.ssm import run_command
+from utils import metrics, waiter
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+WARM_DOCUMENT = 'AWS-RunShellScript'
+
+DATABASES_QUERY = 'SELECT datname FROM pg_database ' \
+                  'WHERE datallowconn AND NOT datistemplate'
+# every relation with storage, largest first so the longest reads start
+# straight away
+RELATIONS_QUERY = "SELECT oid, pg_relation_size(oid) FROM pg_class " \
+                  "WHERE relkind IN ('r', 'i', 'm', 't') " \
+                  "AND pg_relation_size(oid) > 0 ORDER BY 2 DESC"
+# pg_prewarm is dropped again from databases it wasn't installed in
+EXTENSION_QUERY = "SELECT count(*) FROM pg_extension " \
+                  "WHERE extname = 'pg_prewarm'"
+# reading a block is enough for RDS to fetch it from S3, 'read' mode doesn't
+# fill shared buffers on the way
+PREWARM_QUERY = "SELECT pg_prewarm(%s, 'read')"
+
+# the last line the SSM warm-up script prints
+WARMED_PATTERN = re.compile(r'warmed (\d+) bytes in (\d+)s')
+
+
+def format_bytes(size):
+    return f'{size / 1024 ** 3:.1f} GiB'
+
+
+def format_rate(size, seconds):
+    return f'{size / 1024 ** 2 / max(seconds, 1e-6):.1f} MiB/s'
+
+
+class Warmer:
+    # Reads every block of every relation in every database of a freshly
+    # restored PostgreSQL instance through parallel connections, so RDS
+    # loads the storage from S3 now rather than on the first queries.
+
+    def __init__(self, host, port, user, password, database, workers):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self.workers = workers
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.relations = []
+        self.created = []
+        self.total = 0
+        self.done = 0
+        self.remaining = 0
+        self.error = None
+        self.start = None
+
+    def connect(self, database):
+        connection = psycopg2.connect(
+            host=self.host, port=self.port, user=self.user,
+            password=self.password, dbname=database)
+        connection.autocommit = True
+        return connection
+
+    def list_relations(self):
+        connection = self.connect(self.database)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(DATABASES_QUERY)
+                databases = [row[0] for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+        for database in databases:
+            connection = self.connect(database)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(EXTENSION_QUERY)
+                    if not cursor.fetchone()[0]:
+                        cursor.execute('CREATE EXTENSION pg_prewarm')
+                        self.created.append(database)
+                    cursor.execute(RELATIONS_QUERY)
+                    self.relations += [(database, oid, size)
+                                       for oid, size in cursor.fetchall()]
+            finally:
+                connection.close()
+        self.relations.sort(key=lambda r: r[2], reverse=True)
+        self.total = sum(size for _, _, size in self.relations)
+        self.remaining = len(self.relations)
+
+    def drop_extensions(self):
+        for database in self.created:
+            try:
+                connection = self.connect(database)
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute('DROP EXTENSION IF EXISTS pg_prewarm')
+                finally:
+                    connection.close()
+            except Exception as e:
+                logging.error(f'Unable to drop pg_prewarm from {database} on '
+                              f'{self.host}: {e}')
+
+    def warm_relation(self, database, oid, size):
+        # each worker keeps one connection per database
+        key = (threading.get_ident(), database)
+        try:
+            if self.error is None:
+                connection = self.connections.get(key)
+                if connection is None:
+                    connection = self.connect(database)
+                    with self.lock:
+                        self.connections[key] = connection
+                with connection.cursor() as cursor:
+                    cursor.execute(PREWARM_QUERY, (oid,))
+            with self.lock:
+                self.done += size
+        except Exception as e:
+            with self.lock:
+                self.error = self.error or e
+        finally:
+            with self.lock:
+                self.remaining -= 1
+
+    def poll(self):
+        with self.lock:
+            done, remaining, error = self.done, self.remaining, self.error
+        if error is not None:
+            return 'failed', None
+        if not remaining:
+            return 'warmed', 100
+        elapsed = time.monotonic() - self.start
+        logging.warning(f'Warmed {format_bytes(done)} of '
+                        f'{format_bytes(self.total)} on {self.host}, '
+                        f'{format_rate(done, elapsed)}')
+        return 'warming', 100 * done / max(self.total, 1)
+
+    def run(self, name, expected_duration=None):
+        try:
+            self.list_relations()
+            logging.warning(f'Warming {len(self.relations)} relations, '
+                            f'{format_bytes(self.total)}, of {name} with '
+                            f'{self.workers} workers')
+            self.start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for relation in self.relations:
+                    executor.submit(self.warm_relation, *relation)
+                try:
+                    waiter.wait(f'Warm-up of {name}', self.poll,
+                                done=('warmed',), failed=('failed',),
+                                expected_duration=expected_duration)
+                except waiter.WaiterFailure:
+                    raise ValueError(f'Warm-up of {name} failed: '
+                                     f'{self.error}')
+                finally:
+                    # skip any reads still queued
+                    self.error = self.error or 'stopped'
+        finally:
+            for connection in self.connections.values():
+                connection.close()
+            self.drop_extensions()
+        return self.done, time.monotonic() - self.start
+
+
+def warm_db_instance(instance, password, workers, expected_duration=None):
+    # instance is the restored instance as described by RDS
+    if psycopg2 is None:
+        raise ValueError('Warming over direct connections needs psycopg2, '
+                         'install it or use --warm-ssm-instance-name')
+    warmer = Warmer(
+        host=instance['Endpoint']['Address'],
+        port=instance['Endpoint']['Port'],
+        user=instance['MasterUsername'],
+        password=password,
+        database=instance.get('DBName') or 'postgres',
+        workers=workers)
+    warmed, seconds = warmer.run(instance['DBInstanceIdentifier'],
+                                 expected_duration)
+    log_warmed(instance['DBInstanceIdentifier'], warmed, seconds)
+
+
+def get_warm_script(instance, password_parameter, region, workers):
+    # the bastion reads the password from parameter store itself, so it
+    # never appears in the command
+    quote = shlex.quote
+    psql = 'psql -X -q -At'
+    return [
+        'set -euo pipefail',
+        f'export PGHOST={quote(instance["Endpoint"]["Address"])}',
+        f'export PGPORT={instance["Endpoint"]["Port"]}',
+        f'export PGUSER={quote(instance["MasterUsername"])}',
+        f'export PGDATABASE={quote(instance.get("DBName") or "postgres")}',
+        f'export PGPASSWORD="$(aws ssm get-parameter --region {region} '
+        f'--name {quote(password_parameter)} --with-decryption '
+        f'--query Parameter.Value --output text)"',
+        'start=$(date +%s)',
+        'warmed=0',
+        f'for db in $({psql} -c {quote(DATABASES_QUERY)}); do',
+        f'  installed=$({psql} -d "$db" -c {quote(EXTENSION_QUERY)})',
+        '  if [ "$installed" = 0 ]; then',
+        f'    {psql} -d "$db" -c "CREATE EXTENSION pg_prewarm"',
+        # dropped again even when the reads fail
+        f'    trap \'{psql} -d "$db" -c "DROP EXTENSION IF EXISTS '
+        f'pg_prewarm"\' EXIT',
+        '  fi',
+        f'  bytes=$({psql} -d "$db" -c {quote(RELATIONS_QUERY)} | '
+        f'cut -d"|" -f1 | xargs -P {workers} -I{{}} {psql} -d "$db" -c '
+        f'"SELECT pg_prewarm({{}}, \'read\') * '
+        f'current_setting(\'block_size\')::bigint" | '
+        "awk '{s += $1} END {print s + 0}')",
+        '  if [ "$installed" = 0 ]; then',
+        f'    {psql} -d "$db" -c "DROP EXTENSION pg_prewarm"',
+        '    trap - EXIT',
+        '  fi',
+        '  warmed=$((warmed + bytes))',
+        '  echo "warmed $db: $bytes bytes"',
+        'done',
+        'echo "warmed $warmed bytes in $(($(date +%s) - start))s"'
+    ]
+
+
+def warm_db_instance_ssm(account, region, instance, password_parameter,
+                         instance_name, workers):
+    # runs the reads on instances with Name tag instance_name, e.g. a
+    # bastion that can reach the DB
+    client = get_client(account, 'ssm', region)
+    db_instance = instance['DBInstanceIdentifier']
+
+    def on_result(command_id, instance_id, invocation):
+        output = client.get_command_invocation(
+            CommandId=command_id,
+            InstanceId=instance_id).get('StandardOutputContent', '')
+        match = WARMED_PATTERN.search(output)
+        if invocation['Status'] != 'Success' or match is None:
+            logging.error(f'Warm-up of {db_instance} on {instance_id} '
+                          f'finished with status {invocation["Status"]}: '
+                          f'{output[-500:]}')
+            return
+        log_warmed(db_instance, int(match.group(1)), int(match.group(2)))
+
+    results = run_command(
+        account, region, WARM_DOCUMENT, instance_name,
+        parameters={'commands': get_warm_script(
+            instance, password_parameter, region, workers)},
+        on_result=on_result)
+    failed = sorted(i for i, status in results.items() if status != 'Success')
+    if not len(results) or len(failed):
+        raise ValueError(f'Warm-up of {db_instance} failed on instances with '
+                         f'name {instance_name}: ' + ' '.join(failed))
+
+
+def log_warmed(db_instance, warmed, seconds):
+    metrics.add_counter('warmed_storage_bytes', warmed)
+    logging.warning(f'Warmed {format_bytes(warmed)} of {db_instance} in '
+                    f'{int(seconds)}s, {format_rate(warmed, seconds)}')